@@ -0,0 +1,142 @@
+import torch
+
+
+class LSHIndex(object):
+    """ Random-projection LSH over node embeddings, used to propose edge edits
+    without materializing the n x n similarity matrix.
+
+    Every table hashes the nodes to num_bits sign codes of random projections and
+    sorts them by code, so that nodes with similar embeddings are close in the
+    sorted order. The candidates of a node are the `window` nodes on either side
+    of it in each table, so building and querying the index cost O(n log n).
+    The index is only rebuilt when the embeddings drift past `drift`, measured
+    as the relative Frobenius distance to the embeddings it was built from.
+    """
+    def __init__(self, num_bits=16, num_tables=4, window=8, drift=0.1):
+        assert num_bits <= 62, 'codes must fit in int64'
+        self.num_bits = num_bits
+        self.num_tables = num_tables
+        self.window = window
+        self.drift = drift
+        self.snapshot = None
+        self.orders = None  # [T, n] node ids sorted by code
+        self.ranks = None  # [T, n] position of every node in orders
+        self.num_builds = 0
+
+    def drifted(self, feature):
+        if self.snapshot is None or self.snapshot.shape != feature.shape:
+            return True
+        dist = (feature.detach() - self.snapshot).norm()
+        return bool(dist > self.drift * self.snapshot.norm())
+
+    @torch.no_grad()
+    def build(self, feature):
+        feature = feature.detach()
+        n, d = feature.shape
+        planes = torch.randn(self.num_tables, d, self.num_bits, device=feature.device, dtype=feature.dtype)
+        bits = (torch.einsum('nd,tdb->tnb', feature, planes) > 0).long()
+        weights = 2 ** torch.arange(self.num_bits, device=feature.device)
+        codes = (bits * weights).sum(dim=-1)  # [T, n]
+        self.orders = codes.argsort(dim=1)
+        self.ranks = torch.empty_like(self.orders)
+        self.ranks.scatter_(1, self.orders, torch.arange(n, device=feature.device).expand(self.num_tables, n))
+        self.snapshot = feature.clone()
+        self.num_builds += 1
+
+    def update(self, feature):
+        """ rebuilds the index only if the embeddings drifted """
+        if self.drifted(feature):
+            self.build(feature)
+
+    @torch.no_grad()
+    def query(self, feature, edge_index, m):
+        """ returns the top-m non-edge candidates of every node
+            cand [n, m]: candidate source nodes, edge (cand[j, k], j) is not in edge_index
+            score [n, m]: cosine similarity, -inf where a node has fewer than m candidates
+        """
+        feature = feature.detach()
+        n = feature.shape[0]
+        device = feature.device
+        offsets = torch.cat([torch.arange(-self.window, 0, device=device),
+                             torch.arange(1, self.window + 1, device=device)])
+        pos = (self.ranks.unsqueeze(-1) + offsets).clamp(0, n - 1)  # [T, n, 2w]
+        cand = torch.gather(self.orders, 1, pos.view(self.num_tables, -1)).view(self.num_tables, n, -1)
+        cand = cand.permute(1, 0, 2).reshape(n, -1)  # [n, T * 2w]
+
+        cand, invalid = mask_candidates(cand, edge_index)
+
+        x = torch.nn.functional.normalize(feature, p=2, dim=-1)
+        score = (x.unsqueeze(1) * x[cand]).sum(dim=-1)
+        score = score.masked_fill(invalid, float('-inf'))
+        m = min(m, cand.shape[1])
+        score, idx = score.topk(m, dim=1)
+        return torch.gather(cand, 1, idx), score
+
+
+def mask_candidates(cand, edge_index):
+    """ sorts the candidates [n, k] of every node and marks duplicates,
+    self loops and existing edges (cand[j], j) as invalid
+    """
+    n = cand.shape[0]
+    cand, _ = cand.sort(dim=1)
+    node = torch.arange(n, device=cand.device).unsqueeze(1)
+    invalid = cand == node
+    invalid[:, 1:] |= cand[:, 1:] == cand[:, :-1]
+    if edge_index.numel() > 0:
+        edge_key = (edge_index[0] * n + edge_index[1]).sort()[0]
+        cand_key = cand * n + node
+        hit = torch.searchsorted(edge_key, cand_key).clamp(max=edge_key.numel() - 1)
+        invalid |= edge_key[hit] == cand_key
+    return cand, invalid
+
+
+def random_candidates(n, m, edge_index, device):
+    """ m uniformly drawn non-edge candidates per node, invalid ones are marked """
+    cand = torch.randint(0, n, (n, m), device=device)
+    return mask_candidates(cand, edge_index)
+
+
+def sample_edits(cand, score, num_sample):
+    """ samples num_sample candidates per node without replacement, with
+    probability softmax(score) (Gumbel top-k), and returns them as new edges [2, *]
+    """
+    n = cand.shape[0]
+    num_sample = min(num_sample, cand.shape[1])
+    u = torch.rand_like(score).clamp_(1e-10, 1. - 1e-7)
+    keys = score - torch.log(-torch.log(u))
+    keys, idx = keys.topk(num_sample, dim=1)
+    row = torch.gather(cand, 1, idx)
+    col = torch.arange(n, device=cand.device).unsqueeze(1).expand_as(row)
+    valid = torch.isfinite(keys)
+    return torch.stack([row[valid], col[valid]], dim=0)
+
+
+def edge_similarity(feature, edge_index):
+    """ cosine similarity of the endpoints of every edge """
+    x = torch.nn.functional.normalize(feature.detach(), p=2, dim=-1)
+    return (x[edge_index[0]] * x[edge_index[1]]).sum(dim=-1)
+
+
+def sample_flips(cand, score, edge_index, edge_score, num_sample):
+    """ like sample_edits, but the existing edges (k, j) of every node j are
+    candidates next to its non-edge candidates: the sampled non-edges are added
+    and the sampled edges removed, the entries --mode adj flips.
+    returns the edited edge_index
+    """
+    n, num_cand = cand.shape
+    device = cand.device
+    rows = torch.cat([cand.flatten(), edge_index[0]])
+    cols = torch.cat([torch.arange(n, device=device).repeat_interleave(cand.shape[1]), edge_index[1]])
+    u = torch.rand(rows.numel(), device=device).clamp_(1e-10, 1. - 1e-7)
+    keys = torch.cat([score.flatten(), edge_score.to(score.dtype)]) - torch.log(-torch.log(u))
+    # the num_sample largest keys of every node: sorted by key, then stably by node
+    order = keys.argsort(descending=True)
+    order = order[cols[order].argsort(stable=True)]
+    start = torch.searchsorted(cols[order], torch.arange(n, device=device))
+    rank = torch.arange(order.numel(), device=device) - start[cols[order]]
+    chosen = order[(rank < num_sample) & torch.isfinite(keys[order])]
+    added = chosen[chosen < cand.numel()]
+    keep = torch.ones(edge_index.shape[1], dtype=torch.bool, device=device)
+    keep[chosen[chosen >= cand.numel()] - cand.numel()] = False
+    return torch.cat([edge_index[:, keep], torch.stack([rows[added], cols[added]])], dim=1)
+
@@ -0,0 +1,142 @@
+"""
+Successive-halving search over the IENE knobs.
+
+num_configs configs are sampled from a search space and all trained for
+min_budget epochs (pretraining epochs count towards the budget). At every rung
+only the top 1/eta by best validation accuracy survive and keep training from
+where they stopped, for eta times the budget, until the survivors reach the
+full --pre_epochs + --epochs budget. Only the trainer being fit is in memory,
+the others are parked on disk with their rng state between their rungs.
+
+    python asha.py --space sweeps/iene_space.json --num_configs 27 --eta 3 --min_budget 20 \
+        --method iene --dataset cora --gnn_gen gcn --cpu
+
+The space file maps argument names to lists of values, the remaining
+arguments are the base args of main.py.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+
+import torch
+
+from logger import SimpleLogger
+from parse import parser_add_main_args
+from checkpoint import save_atomic
+from train import Trainer, fix_seed, get_device, get_rng_state, set_rng_state, load_datasets, get_criterion, \
+    get_eval_func
+
+
+def sample_configs(space, num_configs, seed):
+    keys = sorted(space.keys())
+    grid = list(itertools.product(*[space[key] for key in keys]))
+    random.Random(seed).shuffle(grid)
+    return [dict(zip(keys, values)) for values in grid[:num_configs]]
+
+
+def best_valid(results):
+    """ (valid, mean test acc) at the best valid epoch, like Logger.print_statistics """
+    result = torch.tensor(results)
+    argmax = result[:, 1].argmax()
+    return result[argmax, 1].item(), result[argmax, 2:].mean().item()
+
+
+def main():
+    search_parser = argparse.ArgumentParser(add_help=False)
+    search_parser.add_argument('--space', type=str, required=True, help='json search space')
+    search_parser.add_argument('--num_configs', type=int, default=27)
+    search_parser.add_argument('--eta', type=int, default=3)
+    search_parser.add_argument('--min_budget', type=int, default=20,
+                               help='epochs of the first rung')
+    search_parser.add_argument('--out', type=str, default='results/asha.json')
+    parser = argparse.ArgumentParser(description='Successive-halving search', parents=[search_parser])
+    parser_add_main_args(parser)
+    args = parser.parse_args()
+
+    device = get_device(args)
+    datasets = load_datasets(args)
+    criterion, eval_func = get_criterion(args), get_eval_func(args)
+    space = json.load(open(args.space))
+    configs = sample_configs(space, args.num_configs, args.seed)
+
+    config_args = []
+    for config in configs:
+        config_args.append(argparse.Namespace(**vars(args)))
+        for key, value in config.items():
+            setattr(config_args[-1], key, value)
+    pre_epochs = config_args[0].pre_epochs if config_args[0].method == 'iene' else 0
+    full_budget = pre_epochs + config_args[0].epochs
+
+    park_dir = tempfile.TemporaryDirectory(prefix='asha-')
+    rng_states, done_epochs = {}, {}
+
+    def fit(i, budget=None):
+        """ fits config i up to budget epochs and parks it, returns its scores """
+        path = os.path.join(park_dir.name, f'{i}.pt')
+        if i in rng_states:
+            trainer = Trainer(config_args[i], datasets, device, criterion, eval_func, verbose=False)
+            trainer.load_state(torch.load(path))
+        else:
+            fix_seed(args.seed + i)
+            trainer = Trainer(config_args[i], datasets, device, criterion, eval_func, verbose=False)
+            rng_states[i] = get_rng_state()
+        set_rng_state(rng_states[i])
+        trainer.fit(budget=budget)
+        rng_states[i] = get_rng_state()
+        done_epochs[i] = trainer.done_epochs
+        save_atomic(trainer.state(), path)
+        return best_valid(trainer.results)
+
+    alive = list(range(len(configs)))
+    budget = args.min_budget
+    rungs = []
+    spent = 0
+    start = time.time()
+    while True:
+        budget = min(budget, full_budget)
+        scores = {}
+        for i in alive:
+            scores[i] = fit(i, budget)
+        ranked = sorted(alive, key=lambda i: scores[i][0], reverse=True)
+        rungs.append({'budget': budget,
+                      'configs': [{'config': configs[i], 'valid': scores[i][0], 'test': scores[i][1]}
+                                  for i in ranked]})
+        print(f'Rung {len(rungs) - 1}: budget {budget}, {len(alive)} configs, '
+              f'best valid {100 * scores[ranked[0]][0]:.2f} {configs[ranked[0]]}')
+        if budget == full_budget or len(alive) == 1:
+            break
+        alive = ranked[:max(1, len(alive) // args.eta)]
+        for i in set(ranked) - set(alive):
+            spent += done_epochs[i]
+            os.remove(os.path.join(park_dir.name, f'{i}.pt'))  # the killed configs never resume
+        budget *= args.eta
+
+    if budget < full_budget:
+        for i in alive:
+            scores[i] = fit(i)
+    spent += sum(done_epochs[i] for i in alive)
+    park_dir.cleanup()
+    print(f'Search finished in {time.time() - start:.1f}s, {spent} epochs spent, '
+          f'a full grid of these configs would take {len(configs) * full_budget}')
+
+    keys = sorted(space.keys())
+    logger = SimpleLogger('Survivors', keys, num_values=2)
+    for i in alive:
+        logger.add_result(0, tuple(configs[i][key] for key in keys), scores[i])
+    logger.display()
+    best = max(alive, key=lambda i: scores[i][0])
+    print('Best config:', ' '.join(f'--{key} {value}' for key, value in configs[best].items()))
+
+    if os.path.dirname(args.out):
+        os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump({'best': configs[best], 'valid': scores[best][0], 'test': scores[best][1],
+                   'rungs': rungs}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Compares the step 6 edit proposal modes (--mode adj/free/ann):
+edit cost of one step 6 call on a random graph, and optionally the final OOD
+test accuracy of full IENE runs on a real dataset.
+
+    python benchmarks/edit_modes.py --num_nodes 2000 --modes adj free ann
+    python benchmarks/edit_modes.py --accuracy --dataset cora --data_dir ../../data --runs 3
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import torch
+import torch.nn as nn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from parse import parse_method_ours, parser_add_main_args
+
+
+def random_graph(n, d, c, avg_degree, device):
+    num_edges = n * avg_degree // 2
+    row = torch.randint(0, n, (num_edges,))
+    col = torch.randint(0, n, (num_edges,))
+    edge_index = torch.cat([torch.stack([row, col]), torch.stack([col, row])], dim=1)
+    graph = {'edge_index': edge_index.to(device),
+             'node_feat': torch.randn(n, d).to(device),
+             'edge_feat': None,
+             'num_nodes': n}
+    label = torch.randint(0, c, (n, 1)).to(device)
+    return SimpleNamespace(graph=graph, label=label, n=n, c=c, d=d)
+
+
+def edit_cost(args, mode, data, device):
+    args.mode = mode
+    model = parse_method_ours(args, data, data.n, data.c, data.d, device)
+    model.init_env_adj(data)
+    model.train()
+    criterion = nn.NLLLoss()
+    model(data, criterion, step=6)  # warm up
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        model(data, criterion, step=6)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    elapsed = (time.perf_counter() - start) / args.repeats
+    num_edits = sum(adj.shape[1] for adj in model.env_adj) - model.e * data.graph['edge_index'].shape[1]
+    peak = torch.cuda.max_memory_allocated() / 2 ** 20 if device.type == 'cuda' else float('nan')
+    return elapsed, num_edits, peak
+
+
+def ood_accuracy(mode, extra):
+    """ runs main.py with --mode and returns the mean final test accuracy over test environments """
+    cmd = [sys.executable, 'main.py', '--method', 'iene', '--mode', mode] + extra
+    out = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    summary = out[out.rindex('All runs:'):]
+    tests = [float(v) for v in re.findall(r'Final Test \d+: ([\d.]+)', summary)]
+    return sum(tests) / len(tests)
+
+
+def main():
+    bench_parser = argparse.ArgumentParser(description='Step 6 edit mode benchmark', add_help=False)
+    bench_parser.add_argument('--modes', nargs='+', default=['adj', 'free', 'ann'])
+    bench_parser.add_argument('--num_nodes', type=int, default=2000)
+    bench_parser.add_argument('--num_feats', type=int, default=128)
+    bench_parser.add_argument('--num_classes', type=int, default=5)
+    bench_parser.add_argument('--avg_degree', type=int, default=4)
+    bench_parser.add_argument('--repeats', type=int, default=5)
+    bench_parser.add_argument('--accuracy', action='store_true',
+                              help='also train full IENE runs per mode, remaining args are passed to main.py')
+    _, main_argv = bench_parser.parse_known_args()
+    parser = argparse.ArgumentParser(parents=[bench_parser])
+    parser_add_main_args(parser)
+    args = parser.parse_args()
+    args.method = 'iene'
+    device = torch.device('cpu') if args.cpu or not torch.cuda.is_available() else torch.device('cuda:' + str(args.device))
+
+    torch.manual_seed(0)
+    data = random_graph(args.num_nodes, args.num_feats, args.num_classes, args.avg_degree, device)
+    print(f'{"mode":>6} {"sec/edit":>10} {"edits":>8} {"peak MB":>9}')
+    for mode in args.modes:
+        elapsed, num_edits, peak = edit_cost(args, mode, data, device)
+        print(f'{mode:>6} {elapsed:>10.4f} {num_edits:>8d} {peak:>9.1f}')
+
+    if args.accuracy:
+        for mode in args.modes:
+            print(f'{mode:>6} mean OOD test acc: {ood_accuracy(mode, main_argv):.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Microbenchmarks of the hot kernels on random graphs of growing size:
+model.gcn_conv, the nets backbones (forward and forward + backward), the
+CudaCKA HSIC variants, step 6 edit generation and evaluate_whole_graph.
+
+Every kernel is timed (median over --repeats after a warm up) and its peak
+memory is recorded (CUDA allocator peak, or the RSS growth on CPU). Kernels
+whose estimated memory exceeds --max_mb at a size are skipped, e.g. the n x n
+Gram matrices of HSIC beyond a few 10k nodes.
+
+    python benchmarks/kernels.py --cpu --sizes 1000 10000 100000 1000000 --save
+    python benchmarks/kernels.py --cpu --sizes 1000 10000 --threshold 0.2
+
+--save stores the results as the baseline of this machine and device, later
+runs are compared against it and exit with status 1 if a kernel got slower
+than baseline * (1 + --threshold). No baseline is shipped, timings do not
+carry over between machines: without --save a run on a machine (hostname and
+device) that has no baseline yet compares nothing and exits with status 2.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import torch
+import torch.nn as nn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from data_utils import evaluate_whole_graph
+from edit_modes import random_graph
+from loss_func import CudaCKA
+from metrics import eval_acc
+from model import Base, gcn_conv
+from parse import parse_method_ours, parser_add_main_args
+from profiling import rss_peak_mb, reset_rss_peak
+
+BACKBONES = ['gcn', 'sage', 'gat', 'gpr', 'gcnii']
+CKA_KERNELS = ['linear', 'rbf', 'poly', 'rq']
+EDIT_MODES = ['adj', 'free', 'ann']
+
+
+def measure(fn, device, repeats):
+    """ median seconds and peak MB of fn() """
+    fn()  # warm up
+    cuda = device.type == 'cuda'
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated() / 2 ** 20
+    else:
+        reset_rss_peak()
+        base = rss_peak_mb()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        if cuda:
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    peak = torch.cuda.max_memory_allocated() / 2 ** 20 if cuda else rss_peak_mb()
+    return statistics.median(times), max(peak - base, 0.)
+
+
+def estimate_mb(kernel, n, num_edges, args):
+    """ rough working set of a kernel, used to skip sizes that would not fit """
+    h, d = args.hidden_channels, args.num_feats
+    if kernel.startswith('hsic') or kernel == 'edit.adj':
+        return 16 * n * n * 4 / 2 ** 20
+    if kernel.startswith('gat'):
+        edges = num_edges if args.gat_chunk <= 0 else min(num_edges, args.gat_chunk) + 2 * n
+        return 4 * edges * args.gat_heads * h * 4 / 2 ** 20
+    if kernel.startswith('evaluate'):
+        return 12 * (n * d + 2 * num_edges + 4 * n * h) * 4 / 2 ** 20
+    return 4 * (n * d + 2 * num_edges + 4 * n * h) * 4 / 2 ** 20
+
+
+def bench_size(args, n, device):
+    torch.manual_seed(0)
+    data = random_graph(n, args.num_feats, args.num_classes, args.avg_degree, device)
+    x, edge_index = data.graph['node_feat'], data.graph['edge_index']
+    num_edges = edge_index.shape[1]
+    criterion = nn.NLLLoss()
+    # factories, a kernel is only built when it runs at this size
+    kernels = {}
+
+    kernels['gcn_conv'] = lambda: lambda: gcn_conv(x, edge_index)
+
+    def backbone(gnn, train):
+        # gcnii is not selectable through parse_method_base
+        model = Base(args, n, args.num_classes, args.num_feats, gnn, device).to(device)
+        if not train:
+            return lambda: torch.no_grad()(model.gnn)(x, edge_index)
+
+        def train_step():
+            model.zero_grad()
+            model(data, criterion).backward()
+        return train_step
+
+    for gnn in BACKBONES:
+        kernels[f'{gnn}.fwd'] = lambda gnn=gnn: backbone(gnn, False)
+        kernels[f'{gnn}.train'] = lambda gnn=gnn: backbone(gnn, True)
+
+    def hsic(kernel):
+        cka_fn = getattr(CudaCKA(device=device), f'{kernel}_CKA')
+        X = torch.randn(n, args.hidden_channels, device=device, requires_grad=True)
+        Y = torch.randn(n, args.hidden_channels, device=device)
+        return lambda: cka_fn(X, Y).backward()
+
+    for kernel in CKA_KERNELS:
+        kernels[f'hsic.{kernel}'] = lambda kernel=kernel: hsic(kernel)
+
+    def edit(mode):
+        # the model reads args.mode at every step
+        mode_args = argparse.Namespace(**vars(args))
+        mode_args.gnn, mode_args.mode = 'gcn', mode
+        model = parse_method_ours(mode_args, data, n, args.num_classes, args.num_feats, device)
+        model.init_env_adj(data)
+        model.train()
+        return lambda: model(data, criterion, step=6)
+
+    for mode in EDIT_MODES:
+        kernels[f'edit.{mode}'] = lambda mode=mode: edit(mode)
+
+    def evaluate():
+        model = Base(args, n, args.num_classes, args.num_feats, 'gcn', device).to(device)
+        envs = [random_graph(n, args.num_feats, args.num_classes, args.avg_degree, device) for _ in range(10)]
+        for env in envs:
+            env.graph['edge_index'] = edge_index
+        return lambda: evaluate_whole_graph(args, model, envs[0], envs[1], envs[2:], eval_acc)
+
+    kernels['evaluate'] = evaluate
+
+    results = {}
+    for name, factory in kernels.items():
+        if args.kernels and not any(name.startswith(k) for k in args.kernels):
+            continue
+        if estimate_mb(name, n, num_edges, args) > args.max_mb:
+            print(f'{name:>14} {n:>9d}   skipped, estimated {estimate_mb(name, n, num_edges, args):.0f} MB')
+            continue
+        seconds, peak = measure(factory(), device, args.repeats)
+        results[f'{name}@{n}'] = {'seconds': seconds, 'peak_mb': peak}
+        print(f'{name:>14} {n:>9d} {1000 * seconds:>11.3f} {peak:>10.1f}', flush=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions, missing = [], []
+    for key, result in results.items():
+        if key not in baseline:
+            missing.append(key)
+            continue
+        ratio = result['seconds'] / baseline[key]['seconds']
+        if ratio > 1 + threshold:
+            regressions.append((key, ratio))
+            print(f'REGRESSION {key}: {1000 * result["seconds"]:.3f}ms vs '
+                  f'{1000 * baseline[key]["seconds"]:.3f}ms baseline ({ratio:.2f}x)')
+        elif ratio < 1 - threshold:
+            print(f'faster     {key}: {ratio:.2f}x of baseline')
+    if baseline and missing:
+        print(f'WARNING: no baseline for {len(missing)} of {len(results)} kernels, they were not compared: '
+              + ' '.join(missing), file=sys.stderr)
+    return regressions
+
+
+def main():
+    bench_parser = argparse.ArgumentParser(description='Kernel microbenchmarks', add_help=False)
+    bench_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    bench_parser.add_argument('--kernels', type=str, nargs='*', default=None,
+                              help='only run kernels starting with these names')
+    bench_parser.add_argument('--num_feats', type=int, default=128)
+    bench_parser.add_argument('--num_classes', type=int, default=5)
+    bench_parser.add_argument('--avg_degree', type=int, default=4)
+    bench_parser.add_argument('--repeats', type=int, default=5)
+    bench_parser.add_argument('--max_mb', type=float, default=4096,
+                              help='skip kernels whose estimated memory is larger')
+    bench_parser.add_argument('--baseline', type=str, default=os.path.join(ROOT, 'benchmarks', 'baselines.json'))
+    bench_parser.add_argument('--save', action='store_true', help='store the results as the baseline')
+    bench_parser.add_argument('--threshold', type=float, default=0.2,
+                              help='relative slowdown reported as a regression')
+    parser = argparse.ArgumentParser(parents=[bench_parser])
+    parser_add_main_args(parser)
+    args = parser.parse_args()
+    device = torch.device('cpu') if args.cpu or not torch.cuda.is_available() else torch.device('cuda:' + str(args.device))
+    machine = f'{platform.node()}/{device.type}'
+
+    print(f'{"kernel":>14} {"nodes":>9} {"ms":>11} {"peak MB":>10}')
+    results = {}
+    for n in args.sizes:
+        results.update(bench_size(args, n, device))
+
+    baselines = json.load(open(args.baseline)) if os.path.exists(args.baseline) else {}
+    regressions = compare(results, baselines.get(machine, {}), args.threshold)
+    if args.save:
+        baselines.setdefault(machine, {}).update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f'Saved baseline of {machine} to {args.baseline}')
+    elif machine not in baselines:
+        print(f'ERROR: no baseline of {machine} in {args.baseline}, nothing was compared. '
+              f'Run once with --save on this machine to record one.', file=sys.stderr)
+        sys.exit(2)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
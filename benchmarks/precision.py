@@ -0,0 +1,88 @@
+"""
+Speed and accuracy of --precision bf16 against fp32 per backbone.
+
+Every --gnns backbone is trained for one run of the given main.py arguments in
+fp32 and in bf16 from the same seed. The main phase epochs/sec, the peak
+memory and the accuracies at the best valid epoch are reported with the
+bf16 - fp32 deltas, and saved as JSON.
+
+    python benchmarks/precision.py --cpu --method iene --dataset cora --epochs 100 --pre_epochs 20
+"""
+import argparse
+import json
+import os
+import sys
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from logger import Logger
+from parse import parser_add_main_args
+from profiling import rss_peak_mb, reset_rss_peak
+from train import Trainer, fix_seed, get_device, load_datasets, get_criterion, get_eval_func
+
+PRECISIONS = ['fp32', 'bf16']
+
+
+def train_once(args, datasets, device):
+    fix_seed(args.seed)
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+    else:
+        reset_rss_peak()
+    logger = Logger(1, args)
+    trainer = Trainer(args, datasets, device, get_criterion(args), get_eval_func(args), verbose=False)
+    trainer.fit(logger)
+    peak = torch.cuda.max_memory_allocated() / 2 ** 20 if device.type == 'cuda' else rss_peak_mb()
+    best = logger.best_summary(0)
+    return {'train_epochs_per_s': args.epochs / trainer.timings['train'],
+            'train_s': trainer.timings['train'],
+            'pretrain_s': trainer.timings['pretrain'],
+            'peak_mb': peak,
+            'valid': float(best[1]),
+            'test': float(best[3:].mean()),
+            'tests': best[3:].tolist()}
+
+
+def main():
+    bench_parser = argparse.ArgumentParser(description='bf16 vs fp32 per backbone', add_help=False)
+    bench_parser.add_argument('--gnns', type=str, nargs='+', default=['gcn', 'sage', 'gat', 'gpr'])
+    bench_parser.add_argument('--out', type=str, default='results/precision.json')
+    parser = argparse.ArgumentParser(parents=[bench_parser])
+    parser_add_main_args(parser)
+    args = parser.parse_args()
+    device = get_device(args)
+    datasets = load_datasets(args)
+
+    records = []
+    print(f'{"gnn":>6} {"precision":>9} {"epochs/s":>9} {"peak MB":>9} {"valid":>7} {"test":>7}')
+    for gnn in args.gnns:
+        record = {'gnn': gnn}
+        for precision in PRECISIONS:
+            config = argparse.Namespace(**vars(args))
+            config.gnn, config.precision, config.runs = gnn, precision, 1
+            result = train_once(config, datasets, device)
+            record[precision] = result
+            print(f'{gnn:>6} {precision:>9} {result["train_epochs_per_s"]:9.2f} {result["peak_mb"]:9.1f} '
+                  f'{result["valid"]:7.2f} {result["test"]:7.2f}', flush=True)
+        fp32, bf16 = record['fp32'], record['bf16']
+        record['speedup'] = bf16['train_epochs_per_s'] / fp32['train_epochs_per_s']
+        record['valid_delta'] = bf16['valid'] - fp32['valid']
+        record['test_delta'] = bf16['test'] - fp32['test']
+        print(f'{gnn:>6} bf16 is {record["speedup"]:.2f}x fp32, valid {record["valid_delta"]:+.2f}, '
+              f'test {record["test_delta"]:+.2f}')
+        records.append(record)
+
+    report = {'device': str(device), 'torch': torch.__version__, 'method': args.method,
+              'dataset': args.dataset, 'epochs': args.epochs, 'backbones': records}
+    if os.path.dirname(args.out):
+        os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Saved to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+SpMM and scatter speed of the --reorder node orders.
+
+The train graph of --dataset (or, with --sizes, community graphs with shuffled
+node ids, whose locality reordering can recover) is renumbered with every
+order and the propagation kernels are timed (median over --repeats):
+
+    spmm        the cached CSR operator of gpr / gcnii, forward
+    spmm.train  forward and backward
+    gcn.train   a GCNConv layer (gather / scatter message passing), forward and backward
+
+    python benchmarks/reorder.py --cpu --dataset amazon-photo --data_dir ../../data
+    python benchmarks/reorder.py --cpu --sizes 100000 1000000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from nets import GCNOperator
+from parse import parser_add_main_args
+from reorder import ORDERS, node_order
+from torch_geometric.nn import GCNConv
+from train import get_dataset
+
+
+def community_graph(n, avg_degree, community, p_in=0.9):
+    """ communities of consecutive ids with a fraction p_in of the edges inside
+    them, then the ids are shuffled """
+    num_edges = n * avg_degree // 2
+    row = torch.randint(0, n, (num_edges,))
+    inside = torch.rand(num_edges) < p_in
+    start = row - row % community
+    col = torch.where(inside, start + torch.randint(0, community, (num_edges,)), torch.randint(0, n, (num_edges,)))
+    col = col.clamp(max=n - 1)
+    shuffle = torch.randperm(n)
+    row, col = shuffle[row], shuffle[col]
+    return torch.cat([torch.stack([row, col]), torch.stack([col, row])], dim=1)
+
+
+def measure(fn, device, repeats):
+    fn()  # warm up
+    times = []
+    for _ in range(repeats):
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        fn()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def bench_graph(args, edge_index, num_nodes, device):
+    torch.manual_seed(0)
+    x = torch.randn(num_nodes, args.hidden_channels, device=device)
+    conv = GCNConv(args.hidden_channels, args.hidden_channels).to(device)
+    results = {}
+    for order in ORDERS:
+        start = time.perf_counter()
+        if order == 'none':
+            index = edge_index
+        else:
+            perm = node_order(order, edge_index, num_nodes)
+            ids = torch.empty_like(perm)
+            ids[perm] = torch.arange(num_nodes)
+            index = ids[edge_index]
+        order_s = time.perf_counter() - start
+        index = index.to(device)
+        op = GCNOperator(index, num_nodes)
+        x_grad = x.clone().requires_grad_()
+
+        def spmm_train():
+            (op @ x_grad).sum().backward()
+
+        def gcn_train():
+            conv.zero_grad()
+            conv(x_grad, index).sum().backward()
+
+        kernels = {'spmm': lambda: op @ x, 'spmm.train': spmm_train, 'gcn.train': gcn_train}
+        results[order] = {'order_s': order_s}
+        for name, fn in kernels.items():
+            results[order][name] = measure(fn, device, args.repeats)
+        none = results['none']
+        print(f'{order:>7} {results[order]["order_s"]:8.2f}s '
+              + ' '.join(f'{1000 * results[order][k]:10.2f} ({none[k] / results[order][k]:.2f}x)' for k in kernels),
+              flush=True)
+    return results
+
+
+def main():
+    bench_parser = argparse.ArgumentParser(description='Node reordering benchmark', add_help=False)
+    bench_parser.add_argument('--sizes', type=int, nargs='*', default=None,
+                              help='community graphs of these sizes instead of --dataset')
+    bench_parser.add_argument('--avg_degree', type=int, default=16)
+    bench_parser.add_argument('--community', type=int, default=200)
+    bench_parser.add_argument('--repeats', type=int, default=5)
+    bench_parser.add_argument('--out', type=str, default='results/reorder.json')
+    parser = argparse.ArgumentParser(parents=[bench_parser])
+    parser_add_main_args(parser)
+    args = parser.parse_args()
+    device = torch.device('cpu') if args.cpu or not torch.cuda.is_available() else torch.device('cuda:' + str(args.device))
+
+    if args.sizes:
+        graphs = {f'community-{n}': (community_graph(n, args.avg_degree, args.community), n) for n in args.sizes}
+    else:
+        dataset = get_dataset(args, args.dataset, sub_dataset=0, gen_model=args.gnn_gen)
+        graphs = {args.dataset: (dataset.graph['edge_index'], dataset.n)}
+
+    report = {'device': str(device), 'torch': torch.__version__, 'hidden_channels': args.hidden_channels,
+              'graphs': {}}
+    for name, (edge_index, num_nodes) in graphs.items():
+        print(f'{name}: {num_nodes} nodes, {edge_index.shape[1]} edges')
+        print(f'{"order":>7} {"compute":>9} {"spmm ms":>18} {"spmm.train ms":>18} {"gcn.train ms":>18}')
+        report['graphs'][name] = {'num_nodes': num_nodes, 'num_edges': edge_index.shape[1],
+                                  'orders': bench_graph(args, edge_index, num_nodes, device)}
+    if os.path.dirname(args.out):
+        os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Saved to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+End-to-end training throughput of the run.sh configurations.
+
+Every `python main.py` line of run.sh is replayed in process as a single run
+of --epochs main epochs (and --pre_epochs pretraining epochs for iene). The
+time is split into pretraining, main loop and evaluation. Epochs/sec and
+train nodes/sec are reported with the peak memory (RSS, or the CUDA allocator
+peak) as JSON, next to the slowdown of iene over erm per dataset and generator.
+
+    python benchmarks/throughput.py --cpu --epochs 10 --pre_epochs 10 --out results/throughput.json
+    python benchmarks/throughput.py --cpu --filter cora --data_dir ../../data
+
+Arguments that are not options of this script are appended to every config.
+"""
+import argparse
+import json
+import os
+import platform
+import shlex
+import subprocess
+import sys
+import time
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from parse import parser_add_main_args
+from profiling import rss_peak_mb, reset_rss_peak
+from train import Trainer, fix_seed, load_datasets, get_criterion, get_eval_func
+
+
+def read_configs(script):
+    """ the argument lists of the main.py lines of script """
+    configs = []
+    for line in open(script):
+        argv = shlex.split(line, comments=True)
+        if len(argv) > 2 and argv[0].startswith('python') and argv[1] == 'main.py':
+            configs.append(argv[2:])
+    return configs
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def throughput(args, datasets, device):
+    fix_seed(args.seed)
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+    else:
+        reset_rss_peak()
+    trainer = Trainer(args, datasets, device, get_criterion(args), get_eval_func(args), verbose=False)
+    start = time.perf_counter()
+    trainer.fit()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    total = time.perf_counter() - start
+    peak = torch.cuda.max_memory_allocated() / 2 ** 20 if device.type == 'cuda' else rss_peak_mb()
+
+    timings = trainer.timings
+    pre_epochs = args.pre_epochs if args.method == 'iene' else 0
+    num_nodes = trainer.dataset_tr.n
+    train_time = timings['pretrain'] + timings['train']
+    return {'total_s': total,
+            'pretrain_s': timings['pretrain'],
+            'train_s': timings['train'],
+            'eval_s': timings['evaluate'],
+            'epochs': pre_epochs + args.epochs,
+            'epochs_per_s': (pre_epochs + args.epochs) / total,
+            'train_epochs_per_s': args.epochs / timings['train'],
+            'nodes_per_s': num_nodes * (pre_epochs + args.epochs) / train_time,
+            'num_nodes': num_nodes,
+            'num_edges': trainer.dataset_tr.graph['edge_index'].shape[1],
+            'peak_mb': peak}
+
+
+def overheads(records):
+    """ iene vs erm (with a gcn backbone) per dataset and generator """
+    by_key = {}
+    for record in records:
+        if record['gnn'] == 'gcn':
+            by_key.setdefault((record['dataset'], record['gnn_gen']), {})[record['method']] = record
+    result = []
+    for (dataset, gnn_gen), methods in sorted(by_key.items()):
+        if 'erm' in methods and 'iene' in methods:
+            erm, iene = methods['erm'], methods['iene']
+            result.append({'dataset': dataset, 'gnn_gen': gnn_gen,
+                           'erm_train_epochs_per_s': erm['train_epochs_per_s'],
+                           'iene_train_epochs_per_s': iene['train_epochs_per_s'],
+                           'train_epoch_slowdown': erm['train_epochs_per_s'] / iene['train_epochs_per_s'],
+                           'total_slowdown': iene['total_s'] / erm['total_s']})
+    return result
+
+
+def main():
+    bench_parser = argparse.ArgumentParser(description='End-to-end throughput benchmark', add_help=False)
+    bench_parser.add_argument('--script', type=str, default=os.path.join(ROOT, 'run.sh'))
+    bench_parser.add_argument('--filter', type=str, nargs='*', default=None,
+                              help='only configs whose arguments contain all of these strings')
+    bench_parser.add_argument('--out', type=str, default='results/throughput.json')
+    bench_parser.add_argument('--cpu', action='store_true')
+    bench_parser.add_argument('--epochs', type=int, default=10)
+    bench_parser.add_argument('--pre_epochs', type=int, default=10)
+    args, extra = bench_parser.parse_known_args()
+    device = torch.device('cpu') if args.cpu or not torch.cuda.is_available() else torch.device('cuda:0')
+
+    parser = argparse.ArgumentParser()
+    parser_add_main_args(parser)
+    configs = read_configs(args.script)
+    if args.filter:
+        configs = [argv for argv in configs if all(f in ' '.join(argv) for f in args.filter)]
+
+    records, environments = [], {}
+    for argv in configs:
+        config = parser.parse_args(argv + extra + ['--runs', '1', '--epochs', str(args.epochs),
+                                                   '--pre_epochs', str(args.pre_epochs)])
+        config.cpu = device.type == 'cpu'
+        key = (config.data_dir, config.dataset, config.gnn_gen, config.reorder)
+        if key not in environments:
+            environments = {key: load_datasets(config)}  # keep one environment set in memory
+        record = {'config': ' '.join(argv), 'method': config.method, 'dataset': config.dataset,
+                  'gnn_gen': config.gnn_gen, 'gnn': config.gnn}
+        record.update(throughput(config, environments[key], device))
+        records.append(record)
+        print(f'{record["config"]}\n    {record["total_s"]:.2f}s: pretrain {record["pretrain_s"]:.2f}s, '
+              f'train {record["train_s"]:.2f}s, eval {record["eval_s"]:.2f}s, '
+              f'{record["epochs_per_s"]:.1f} epochs/s, {record["nodes_per_s"]:.0f} nodes/s, '
+              f'peak {record["peak_mb"]:.0f} MB', flush=True)
+
+    report = {'commit': git_commit(), 'machine': platform.node(), 'device': str(device),
+              'torch': torch.__version__, 'epochs': args.epochs, 'pre_epochs': args.pre_epochs,
+              'configs': records, 'iene_overhead': overheads(records)}
+    for overhead in report['iene_overhead']:
+        print(f'{overhead["dataset"]}/{overhead["gnn_gen"]}: iene main epochs are '
+              f'{overhead["train_epoch_slowdown"]:.1f}x slower than erm, {overhead["total_slowdown"]:.1f}x in total')
+    if os.path.dirname(args.out):
+        os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Saved to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import os
+import queue
+import threading
+
+import numpy as np
+import torch
+
+
+def snapshot(obj):
+    """ copies every tensor of a nested state to the cpu, so the training can go on
+    while the copy is written
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [snapshot(v) for v in obj]
+    if isinstance(obj, tuple):
+        return tuple(snapshot(v) for v in obj)
+    if isinstance(obj, np.ndarray):
+        return obj.copy()
+    return obj
+
+
+def save_atomic(state, path):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, device='cpu'):
+    return torch.load(path, map_location=device)
+
+
+class AsyncCheckpointer(object):
+    """ writes checkpoints on a background thread.
+    save() only takes the cpu snapshot, a pending checkpoint that has not been
+    written yet is replaced by the newer one
+    """
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue(maxsize=1)
+        self.error = None
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def _write_loop(self):
+        while True:
+            state = self.queue.get()
+            if state is None:
+                self.queue.task_done()
+                return
+            try:
+                save_atomic(state, self.path)
+            except Exception as e:
+                self.error = e
+            self.queue.task_done()
+
+    def save(self, state):
+        if self.error is not None:
+            raise self.error
+        state = snapshot(state)
+        while True:
+            try:
+                self.queue.put_nowait(state)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,214 @@
+"""
+Local training daemon, keeps the environment sets resident between jobs.
+
+Every `python main.py` pays for the interpreter, the torch / torch_geometric
+imports and loading the 10 environments before its first epoch. The daemon
+pays for them once: it listens on a Unix socket (no network), keeps the last
+--max_envs (data_dir, dataset, gnn_gen, reorder) environment sets loaded together with
+their batched evaluation graph, and runs the jobs one at a time in arrival
+order. A job is the argument list of main.py, run in the working directory of
+the client, whose output is streamed back line by line.
+
+    python daemon.py serve &
+    python daemon.py run -- --method iene --dataset cora --gnn_gen gcn --cpu
+    python daemon.py status
+    python daemon.py stop
+
+The client only imports the standard library.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import time
+import traceback
+from collections import OrderedDict
+
+SOCKET = os.path.join(tempfile.gettempdir(), f'iene-{os.getuid()}.sock')
+
+
+def send(wfile, message):
+    wfile.write((json.dumps(message) + '\n').encode())
+    wfile.flush()
+
+
+class StreamWriter(io.TextIOBase):
+    """ text stream sending every complete line to the client as {key: line} """
+    def __init__(self, wfile, key):
+        self.wfile = wfile
+        self.key = key
+        self.buffer = ''
+
+    def write(self, text):
+        self.buffer += text
+        if '\n' in self.buffer:
+            lines, self.buffer = self.buffer.rsplit('\n', 1)
+            send(self.wfile, {self.key: lines + '\n'})
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            send(self.wfile, {self.key: self.buffer})
+            self.buffer = ''
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        server = self.server
+        if request['cmd'] == 'status':
+            send(self.wfile, {'done': {'pid': os.getpid(), 'jobs': server.jobs,
+                                       'environments': [list(key) for key in server.environments]}})
+        elif request['cmd'] == 'stop':
+            server.stopping = True
+            send(self.wfile, {'done': {'pid': os.getpid(), 'jobs': server.jobs}})
+        elif request['cmd'] == 'run':
+            self.run_job(request['argv'], request['cwd'])
+        else:
+            send(self.wfile, {'error': f'unknown command {request["cmd"]}\n'})
+
+    def run_job(self, argv, cwd):
+        out, err = StreamWriter(self.wfile, 'out'), StreamWriter(self.wfile, 'err')
+        start, status, error = time.time(), 0, None
+        os.chdir(cwd)
+        try:
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                try:
+                    self.server.run(argv)
+                except SystemExit as e:  # --help and argument errors
+                    status = e.code if isinstance(e.code, int) else 1
+                finally:
+                    out.flush()
+                    err.flush()
+        except BrokenPipeError:
+            print(f'client of job {self.server.jobs} disconnected, job aborted', file=sys.stderr)
+            return
+        except Exception:
+            error = traceback.format_exc()
+        finally:
+            os.chdir(self.server.cwd)
+            self.server.jobs += 1
+        try:
+            if error is not None:
+                send(self.wfile, {'error': error})
+            else:
+                send(self.wfile, {'done': {'status': status, 'seconds': time.time() - start}})
+        except BrokenPipeError:
+            pass
+
+
+class Daemon(socketserver.UnixStreamServer):
+    def __init__(self, path, max_envs=4):
+        super(Daemon, self).__init__(path, JobHandler)
+        os.chmod(path, 0o600)
+        self.cwd = os.getcwd()
+        self.max_envs = max_envs
+        self.environments = OrderedDict()
+        self.jobs = 0
+        self.stopping = False
+
+        # the imports every job would pay for
+        import main
+        import model
+        from parse import parser_add_main_args
+        from train import load_datasets
+        self.main = main
+        self.load_datasets = load_datasets
+        self.parser = argparse.ArgumentParser(prog='main.py', description='General Training Pipeline')
+        parser_add_main_args(self.parser)
+
+    def datasets(self, args):
+        key = (os.path.abspath(args.data_dir), args.dataset, args.gnn_gen, args.reorder)
+        if key in self.environments:
+            self.environments.move_to_end(key)
+            print(f'Using resident environments {args.dataset}/{args.gnn_gen}')
+        else:
+            self.environments[key] = self.load_datasets(args)
+            while len(self.environments) > self.max_envs:
+                self.environments.popitem(last=False)
+        return self.environments[key]
+
+    def run(self, argv):
+        args = self.parser.parse_args(argv)
+        print(args)
+        self.main.run(args, self.datasets(args))
+
+    def serve(self):
+        print(f'Listening on {self.server_address}', file=sys.stderr, flush=True)
+        while not self.stopping:
+            self.handle_request()
+
+
+def serve(path, max_envs):
+    if os.path.exists(path):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(path)
+            sys.exit(f'A daemon is already listening on {path}')
+        except ConnectionRefusedError:
+            os.unlink(path)  # stale socket of a killed daemon
+    daemon = Daemon(path, max_envs)
+    try:
+        daemon.serve()
+    finally:
+        daemon.server_close()
+        os.unlink(path)
+
+
+def request(path, message):
+    """ sends message to the daemon, returns the exit status of the job """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sys.exit(f'No daemon listening on {path}, start one with `python daemon.py serve`')
+    with sock:
+        sock.sendall((json.dumps(message) + '\n').encode())
+        for line in sock.makefile('r', encoding='utf-8'):
+            reply = json.loads(line)
+            if 'out' in reply:
+                sys.stdout.write(reply['out'])
+                sys.stdout.flush()
+            elif 'err' in reply:
+                sys.stderr.write(reply['err'])
+            elif 'error' in reply:
+                sys.stderr.write(reply['error'])
+                return 1
+            elif 'done' in reply:
+                if message['cmd'] != 'run':
+                    print(json.dumps(reply['done']))
+                return reply['done'].get('status', 0)
+    sys.stderr.write('The daemon closed the connection\n')
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local training daemon')
+    parser.add_argument('--socket', type=str, default=SOCKET)
+    commands = parser.add_subparsers(dest='cmd', required=True)
+    serve_parser = commands.add_parser('serve', help='run the daemon')
+    serve_parser.add_argument('--max_envs', type=int, default=4,
+                              help='environment sets kept resident')
+    run_parser = commands.add_parser('run', help='run main.py arguments on the daemon')
+    run_parser.add_argument('argv', nargs=argparse.REMAINDER)
+    commands.add_parser('status', help='print the resident environments')
+    commands.add_parser('stop', help='stop the daemon after the running job')
+    args = parser.parse_args()
+
+    if args.cmd == 'serve':
+        serve(args.socket, args.max_envs)
+        return
+    message = {'cmd': args.cmd}
+    if args.cmd == 'run':
+        argv = args.argv[1:] if args.argv[:1] == ['--'] else args.argv
+        message.update(argv=argv, cwd=os.getcwd())
+    sys.exit(request(args.socket, message))
+
+
+if __name__ == '__main__':
+    main()
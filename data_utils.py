@@ -5,10 +5,11 @@ import torch
 import torch.nn.functional as F
 import numpy as np
 from scipy import sparse as sp
-from sklearn.metrics import roc_auc_score, f1_score
 
 from torch_sparse import SparseTensor
-from google_drive_downloader import GoogleDriveDownloader as gdd
+
+from metrics import eval_acc, eval_rocauc, eval_f1, batched_metrics
+from reorder import to_original
 
 def rand_train_test_idx(label, train_prop=.5, valid_prop=.25, ignore_negative=True):
     """ randomly splits label into train/valid/test splits """
@@ -159,51 +160,6 @@ def gen_normalized_adjs(dataset):
     return DAD, DA, AD
 
 
-def eval_acc(y_true, y_pred):
-    acc_list = []
-    y_true = y_true.detach().cpu().numpy()
-    y_pred = y_pred.argmax(dim=-1, keepdim=True).detach().cpu().numpy()
-
-    # for i in range(y_true.shape[1]):
-    #     is_labeled = y_true[:, i] == y_true[:, i]
-    #     correct = y_true[is_labeled, i] == y_pred[is_labeled, i]
-    #     acc_list.append(float(np.sum(correct))/len(correct))
-    #return sum(acc_list)/len(acc_list)
-    return (y_true == y_pred).sum() / y_true.shape[0]
-
-
-def eval_rocauc(y_true, y_pred):
-    """ adapted from ogb
-    https://github.com/snap-stanford/ogb/blob/master/ogb/nodeproppred/evaluate.py"""
-    rocauc_list = []
-    y_true = y_true.detach().cpu().numpy()
-    if y_true.shape[1] == 1:
-        # use the predicted class for single-class classification
-        y_pred = F.softmax(y_pred, dim=-1)[:,1].unsqueeze(1).cpu().numpy()
-    else:
-        y_pred = y_pred.detach().cpu().numpy()
-
-    for i in range(y_true.shape[1]):
-        # AUC is only defined when there is at least one positive data.
-        if np.sum(y_true[:, i] == 1) > 0 and np.sum(y_true[:, i] == 0) > 0:
-            is_labeled = y_true[:, i] == y_true[:, i]
-            score = roc_auc_score(y_true[is_labeled, i], y_pred[is_labeled, i])
-                                
-            rocauc_list.append(score)
-
-    if len(rocauc_list) == 0:
-        raise RuntimeError(
-            'No positively labeled data available. Cannot compute ROC-AUC.')
-
-    return sum(rocauc_list)/len(rocauc_list)
-
-def eval_f1(y_true, y_pred):
-    y_true = y_true.detach().cpu().numpy()
-    y_pred = y_pred.argmax(dim=-1, keepdim=True).detach().cpu().numpy()
-    f1 = f1_score(y_true, y_pred, average='weighted')
-    # macro_f1 = f1_score(y_true, y_pred, average='macro')
-    return f1
-
 @torch.no_grad()
 def evaluate(model, dataset, split_idx, eval_func, result=None):
     if result is not None:
@@ -221,19 +177,54 @@ def evaluate(model, dataset, split_idx, eval_func, result=None):
 
     return train_acc, valid_acc, test_acc, out
 
+class EnvironmentBatch(object):
+    """ stacks the environments into one disjoint graph, so that all of them
+    are evaluated by a single forward pass
+    """
+    def __init__(self, datasets, device):
+        self.datasets = list(datasets)
+        self.sizes = [dataset.graph['num_nodes'] for dataset in self.datasets]
+        offsets = np.cumsum([0] + self.sizes[:-1]).tolist()
+        edge_index = torch.cat([dataset.graph['edge_index'] + offset
+                                for dataset, offset in zip(self.datasets, offsets)], dim=1)
+        node_feat = torch.cat([dataset.graph['node_feat'] for dataset in self.datasets], dim=0)
+        self.graph = {'edge_index': edge_index.to(device),
+                      'node_feat': node_feat.to(device),
+                      'edge_feat': None,
+                      'num_nodes': sum(self.sizes)}
+        self.label = torch.cat([dataset.label for dataset in self.datasets], dim=0).to(device)
+        self.device = device
+
+    def matches(self, datasets, device):
+        return self.device == device and len(datasets) == len(self.datasets) \
+            and all(a is b for a, b in zip(datasets, self.datasets))
+
+
 @torch.no_grad()
-def evaluate_whole_graph(args, model, dataset_tr, dataset_val, datasets_te, eval_func, data_loaders=None, partial=False):
+def evaluate_whole_graph(args, model, dataset_tr, dataset_val, datasets_te, eval_func, data_loaders=None,
+                         partial=False, return_outs=False):
+    """ evaluates train, valid and all test environments in one batched forward,
+    metrics from the metrics module are computed for all environments at once on
+    device and copied to the host once. test logits are only kept with return_outs,
+    in the original node order of --reorder datasets
+    """
     model.eval()
-    accs, test_outs = [], []
-    train_out = model.inference(dataset_tr, partial)
-    train_acc = eval_func(dataset_tr.label, train_out)
-    valid_out = model.inference(dataset_val, partial)
-    valid_acc = eval_func(dataset_val.label, valid_out)
-    accs += [train_acc] + [valid_acc]
-    for i, dataset in enumerate(datasets_te):
-        out = model.inference(dataset, partial)
-        test_outs.append(out)
-        accs.append(eval_func(dataset.label, out))
+    datasets = [dataset_tr, dataset_val] + list(datasets_te)
+    # cached on the train environment, so it lives as long as the environments
+    env_batch = getattr(dataset_tr, 'env_batch', None)
+    if env_batch is None or not env_batch.matches(datasets, model.device):
+        env_batch = dataset_tr.env_batch = EnvironmentBatch(datasets, model.device)
+    out = model.inference(env_batch, partial).float()
+    batched = batched_metrics.get(eval_func)
+    if batched is not None and len(set(env_batch.sizes)) == 1:
+        E, n = len(datasets), env_batch.sizes[0]
+        accs = batched(env_batch.label.view(E, n, -1), out.view(E, n, -1)).tolist()
+    else:
+        outs = out.split(env_batch.sizes)
+        accs = [eval_func(dataset.label, o) for dataset, o in zip(datasets, outs)]
+    test_outs = None
+    if return_outs:
+        test_outs = [to_original(dataset, o) for dataset, o in zip(datasets[2:], out.split(env_batch.sizes)[2:])]
 
     return accs, test_outs
 
@@ -243,6 +234,7 @@ def load_fixed_splits(dataset, sub_dataset):
         name += f'-{sub_dataset}'
 
     if not os.path.exists(f'./data/splits/{name}-splits.npy'):
+        from google_drive_downloader import GoogleDriveDownloader as gdd
         assert dataset in splits_drive_url.keys()
         gdd.download_file_from_google_drive(
             file_id=splits_drive_url[dataset], \
@@ -2,11 +2,6 @@ from collections import defaultdict
 import numpy as np
 import torch
 import torch.nn.functional as F
-import scipy
-import scipy.io
-from sklearn.preprocessing import label_binarize
-from ogb.nodeproppred import NodePropPredDataset
-from torch_geometric.datasets import Planetoid, Amazon
 
 from data_utils import rand_train_test_idx, even_quantile_labels, to_sparse_tensor, dataset_drive_url
 
@@ -64,17 +59,26 @@ def load_nc_dataset(data_dir, dataname, sub_dataname='', gen_model='gcn'):
         raise ValueError('Invalid dataname')
     return dataset
 
+def gen_dir(data_dir, name):
+    """ directory of the generated environments of a dataset """
+    if name == 'cora':
+        return '{}/Planetoid/cora/gen'.format(data_dir)
+    elif name == 'amazon-photo':
+        return '{}/Amazon/Photo/gen'.format(data_dir)
+    raise ValueError('Invalid dataname')
+
 def load_synthetic_dataset(data_dir, name, lang, gen_model='gcn'):
+    from torch_geometric.datasets import Planetoid, Amazon
     dataset = NCDataset(lang)
 
     assert lang in range(0, 10), 'Invalid dataset'
 
     if name == 'cora':
-        node_feat, y = pkl.load(open('{}/Planetoid/cora/gen/{}-{}.pkl'.format(data_dir, lang, gen_model), 'rb'))
+        node_feat, y = pkl.load(open('{}/{}-{}.pkl'.format(gen_dir(data_dir, name), lang, gen_model), 'rb'))
         torch_dataset = Planetoid(root='{}/Planetoid'.format(data_dir),
                               name='cora')
     elif name == 'amazon-photo':
-        node_feat, y = pkl.load(open('{}/Amazon/Photo/gen/{}-{}.pkl'.format(data_dir, lang, gen_model), 'rb'))
+        node_feat, y = pkl.load(open('{}/{}-{}.pkl'.format(gen_dir(data_dir, name), lang, gen_model), 'rb'))
         torch_dataset = Amazon(root='{}/Amazon'.format(data_dir),
                                   name='Photo')
     data = torch_dataset[0]
@@ -0,0 +1,192 @@
+"""
+Pre-flight cost model of a configuration (--dry_run, --memory_budget).
+
+From n, E, d, c of the train environment and the model args it estimates the
+FLOPs and the peak memory of an epoch of every phase (iene pretraining, main
+phase, evaluation of all environments). The estimates are rough (activations
+kept for backward, no allocator overhead) but catch the terms that grow with
+n^2 or E * heads: the dense step 6 edits (--mode adj/x), the n x n Gram
+matrices of HSIC (all kernels but linear) and the per-edge GAT attention
+(unless --gat_chunk).
+"""
+FLOAT = 4
+
+
+class Cost(object):
+    """ forward flops and the bytes alive at the peak of a computation """
+    def __init__(self, flops=0., memory=0.):
+        self.flops = flops
+        self.memory = memory
+
+    def __add__(self, other):
+        # sequential: the flops add up, the activations kept for backward too
+        return Cost(self.flops + other.flops, self.memory + other.memory)
+
+    def __mul__(self, k):
+        return Cost(self.flops * k, self.memory * k)
+
+
+def linear(n, i, o):
+    return Cost(2 * n * i * o, n * o * FLOAT)
+
+
+def gcn_layers(n, E, dims, norm=True):
+    """ GCNConv layers with batchnorm, relu and dropout in between """
+    cost = Cost()
+    for i, o in zip(dims[:-1], dims[1:]):
+        cost += linear(n, i, o) + Cost(2 * (E + n) * o, (E + n) * FLOAT)
+        if norm:
+            cost += Cost(6 * n * o, 3 * n * o * FLOAT)
+    return cost
+
+
+def backbone(args, n, E, d, out):
+    h, L, H = args.hidden_channels, args.num_layers, args.gat_heads
+    if args.gnn == 'gcn':
+        return gcn_layers(n, E, [d] + [h] * (L - 1) + [out])
+    if args.gnn == 'sage':
+        dims = [d] + [h] * (L - 1) + [out]
+        cost = Cost()
+        for i, o in zip(dims[:-1], dims[1:]):
+            cost += linear(n, i, o) * 2 + Cost(2 * E * i, n * i * FLOAT) + Cost(6 * n * o, 3 * n * o * FLOAT)
+        return cost
+    if args.gnn == 'gat':
+        ins, outs = [d] + [h * H] * (L - 1), [h] * (L - 1) + [out]
+        # scores, softmax and messages are materialized per edge and head, with
+        # --gat_chunk for one chunk of edges at a time next to the per node sums
+        edges = E + n if args.gat_chunk <= 0 else min(E + n, args.gat_chunk) + 2 * n
+        cost = Cost()
+        for i, o in zip(ins, outs):
+            cost += linear(n, i, o * H) + Cost(8 * (E + n) * H * o, 3 * edges * H * o * FLOAT)
+        return cost
+    if args.gnn == 'gpr':
+        K = 10
+        return linear(n, d, h) + linear(n, h, out) + Cost(2 * K * (E + n) * out, K * n * out * FLOAT)
+    if args.gnn == 'gcnii':
+        cost = linear(n, d, h) + linear(n, h, out)
+        for _ in range(L):
+            cost += linear(n, h, h) + Cost(2 * (E + n) * h, 3 * n * h * FLOAT)
+        return cost
+    raise ValueError('Invalid method')
+
+
+def mlp(n, i, h, o):
+    return linear(n, i, h) + linear(n, h, o)
+
+
+def hsic(args, n, h):
+    if args.kernel == 'linear':
+        # CudaCKA computes the linear HSICs in feature space
+        return Cost(3 * 2 * n * h * h, 3 * n * h * FLOAT)
+    # 3 HSICs of two n x n kernels, each centered by two n x n x n matmuls
+    return Cost(3 * (4 * n * n * h + 8 * n ** 3), 20 * n * n * FLOAT)
+
+
+def edits(args, n, E, d, h):
+    """ one step 6 call """
+    ir = gcn_layers(n, E, [d, h, h])
+    if args.mode in ('adj', 'x'):
+        per_env = Cost(4 * n * n * d, 2 * n * d * FLOAT) + gcn_layers(n, E, [d, h, h]) + mlp(n, h, h, args.e) \
+            + backbone(args, n, E + n * args.num_sample, d, h) * 2
+        # with the backward to adj_continuous / x, the graph of an env is freed before the next one
+        per_env = Cost(3 * args.e * per_env.flops, per_env.memory)
+        # adj_continuous, its grad, Bk, P, A, A_c, M and C are n x n
+        return ir + per_env + Cost(10 * n * n * args.e, 8 * n * n * FLOAT)
+    m = args.ann_topm if args.mode == 'ann' else args.free_candidates
+    cost = ir + Cost(args.e * 4 * n * m * h, n * m * (h + 2) * FLOAT)
+    if args.mode == 'ann':
+        # the existing edges are flip candidates too
+        cost += Cost(2 * n * h * args.ann_bits * args.ann_tables + 2 * E * h, (n * args.ann_tables + 3 * E) * 8)
+    return cost
+
+
+def epoch_costs(args, n, E, d, c, num_envs):
+    """ {phase: (flops, peak bytes)} of one epoch """
+    h, e = args.hidden_channels, args.e
+    base = (n * d + 2 * E + n) * FLOAT  # features, edges and labels
+    inputs = Cost(0, base)
+    phases = {}
+    if args.method == 'erm':
+        step = backbone(args, n, E, d, c)
+        phases['train'] = (3 * step.flops, base + step.memory)
+    else:
+        gnn = backbone(args, n, E, d, h)
+        cls = mlp(n, h, h, c)
+        env = gcn_layers(n, E, [d, h, h]) + mlp(n, h, h, e)
+        top = env  # every step starts with ir_Learner and e_cls
+        steps = {
+            1: top + gnn + cls * e,
+            2: top + gnn * 2 + cls * (e + 1),
+            3: top + env + gnn + gcn_layers(n, E, [2 * h, h, d]) + hsic(args, n, h),
+            4: top * 2 + gnn + cls * (e + 1),
+            5: top * 2 + gnn * (e + 2) + cls * (2 * e + 1),
+        }
+        for k, step in steps.items():
+            steps[k] = Cost(3 * step.flops, step.memory)  # forward and backward
+        steps[6] = edits(args, n, E, d, h)
+        pretrain = [steps[1], steps[2], steps[3], steps[4] * (1. / args.pud_ro_step)]
+        train = [steps[1], steps[5], steps[6] * (1. / args.pud_a_step)]
+        phases['pretrain'] = (sum(s.flops for s in pretrain), base + max(steps[k].memory for k in (1, 2, 3, 4)))
+        phases['train'] = (sum(s.flops for s in train), base + max(steps[k].memory for k in (1, 5, 6)))
+        phases['steps'] = {k: (s.flops, base + s.memory) for k, s in steps.items()}
+    # all environments in one no-grad forward, only two layers are alive at a time
+    out = c if args.method == 'erm' else h
+    infer = backbone(args, n * num_envs, E * num_envs, d, out)
+    layers = max(args.num_layers, 2)
+    phases['evaluate'] = (infer.flops, inputs.memory * num_envs + 2 * infer.memory / layers)
+    return phases
+
+
+def peak_memory(phases):
+    return max(phases[phase][1] for phase in ('pretrain', 'train', 'evaluate') if phase in phases)
+
+
+def preflight(args, dataset, num_envs, budget_gb=0., auto_scale=False):
+    """ estimates the costs of args on dataset and checks them against the
+    budget. with auto_scale dense step 6 edits are switched to --mode ann if
+    that fits, the original mode is kept in args.auto_scaled. the HSIC kernel
+    is never switched, a linear kernel is another objective.
+    returns the estimates, raises ValueError if the config does not fit
+    """
+    n, d, c = dataset.n, dataset.d, dataset.c
+    E = dataset.graph['edge_index'].shape[1]
+    phases = epoch_costs(args, n, E, d, c, num_envs)
+    if budget_gb <= 0:
+        return phases
+    budget = budget_gb * 2 ** 30
+    peak = peak_memory(phases)
+    if peak <= budget:
+        return phases
+
+    if args.method == 'iene' and auto_scale and args.mode in ('adj', 'x') and phases['steps'][6][1] > budget:
+        # the same edits, sampled from the ANN candidates instead of the dense gradient
+        mode, args.mode = args.mode, 'ann'
+        scaled = epoch_costs(args, n, E, d, c, num_envs)
+        if peak_memory(scaled) <= budget:
+            print(f'Estimated peak {peak / 2 ** 30:.2f} GB exceeds --memory_budget {budget_gb} GB, switching '
+                  f'--mode {mode} to ann ({peak_memory(scaled) / 2 ** 30:.2f} GB)')
+            args.auto_scaled = {'mode': mode}
+            return scaled
+        args.mode = mode
+    reasons = []
+    if args.method == 'iene':
+        steps = phases['steps']
+        if steps[3][1] > budget:
+            reasons.append(f'HSIC --kernel {args.kernel} builds n x n Gram matrices ({n} nodes), '
+                           f'pass --kernel linear to train with the linear HSIC instead'
+                           + (' (--auto_scale does not change the kernel)' if auto_scale else ''))
+        if args.mode in ('adj', 'x') and steps[6][1] > budget:
+            reasons.append(f'step 6 --mode {args.mode} is dense in n, try --mode ann or free')
+    if args.gnn == 'gat' and args.gat_chunk <= 0:
+        reasons.append(f'GAT keeps {args.gat_heads} heads per edge, try --gat_chunk or fewer --gat_heads')
+    raise ValueError(f'Estimated peak memory {peak / 2 ** 30:.2f} GB exceeds --memory_budget {budget_gb} GB'
+                     + (': ' + '; '.join(reasons) if reasons else ''))
+
+
+def print_costs(phases):
+    for phase in ('pretrain', 'train', 'evaluate'):
+        if phase in phases:
+            flops, memory = phases[phase]
+            print(f'{phase:>9}: {flops / 1e9:12.2f} GFLOP/epoch, peak {memory / 2 ** 30:8.3f} GB')
+    for k, (flops, memory) in sorted(phases.get('steps', {}).items()):
+        print(f'   step {k}: {flops / 1e9:12.2f} GFLOP/call,  peak {memory / 2 ** 30:8.3f} GB')
@@ -1,40 +1,129 @@
 import torch
 from collections import defaultdict
 
+from results import best_results
+
+class RunningStats(object):
+    """ Welford mean and variance of vectors, values can also be removed again """
+    def __init__(self, dim):
+        self.n = 0
+        self.mean = torch.zeros(dim, dtype=torch.float64)
+        self.m2 = torch.zeros(dim, dtype=torch.float64)
+
+    def add(self, x):
+        x = torch.as_tensor(x, dtype=torch.float64)
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def remove(self, x):
+        x = torch.as_tensor(x, dtype=torch.float64)
+        if self.n == 1:
+            self.n = 0
+            self.mean.zero_()
+            self.m2.zero_()
+            return
+        delta = x - self.mean
+        self.n -= 1
+        self.mean -= delta / self.n
+        self.m2 -= delta * (x - self.mean)
+
+    def std(self):
+        if self.n < 2:
+            return torch.full_like(self.mean, float('nan'))
+        return (self.m2.clamp(min=0) / (self.n - 1)).sqrt()
+
+
 class Logger(object):
-    """ Adapted from https://github.com/snap-stanford/ogb/ """
-    def __init__(self, runs, info=None):
+    """ Adapted from https://github.com/snap-stanford/ogb/
+    results are kept in a preallocated [runs, epochs, metrics] tensor that grows
+    by doubling. the best valid epoch of every run is tracked as results come in
+    and the best rows are averaged across runs on the fly, so summary() is cheap
+    after every epoch
+    """
+    def __init__(self, runs, info=None, epochs=None):
         self.info = info
-        self.results = [[] for _ in range(runs)]
+        self.runs = runs
+        if epochs is None:
+            epochs = getattr(info, 'pre_epochs', 0) + getattr(info, 'epochs', 0) if info is not None else 0
+        self.capacity = max(epochs, 16)
+        self.data = None  # allocated at the first result, when the num of metrics is known
+        self.counts = torch.zeros(runs, dtype=torch.long)
+        self.stats = None
+
+    def _allocate(self, num_metrics):
+        self.data = torch.zeros(self.runs, self.capacity, num_metrics)
+        self.highest_train = torch.full((self.runs,), float('-inf'))
+        self.best_valid = torch.full((self.runs,), float('-inf'))
+        self.best_row = torch.zeros(self.runs, num_metrics)  # in percent
+        self.stats = RunningStats(num_metrics + 1)
 
     def add_result(self, run, result):
         # assert len(result) == 3
-        assert run >= 0 and run < len(self.results)
-        self.results[run].append(result)
+        assert run >= 0 and run < self.runs
+        result = torch.as_tensor(result, dtype=torch.float).cpu().flatten()
+        if self.data is None:
+            self._allocate(result.shape[0])
+        count = self.counts[run].item()
+        if count == self.data.shape[1]:
+            data = torch.zeros(self.runs, 2 * self.data.shape[1], self.data.shape[2])
+            data[:, :count] = self.data
+            self.data = data
+        self.data[run, count] = result
+        self.counts[run] += 1
+
+        old = self.best_summary(run) if count > 0 else None
+        scaled = 100 * result
+        self.highest_train[run] = torch.maximum(self.highest_train[run], scaled[0])
+        if scaled[1] > self.best_valid[run]:
+            self.best_valid[run] = scaled[1]
+            self.best_row[run] = scaled
+        if old is not None:
+            self.stats.remove(old)
+        self.stats.add(self.best_summary(run))
+
+    def best_summary(self, run):
+        """ [highest train, highest valid, final train, final test...] of run in percent """
+        row = self.best_row[run]
+        return torch.cat([self.highest_train[run:run + 1], self.best_valid[run:run + 1], row[:1], row[2:]])
+
+    def summary(self):
+        """ mean and std of best_summary over the runs with results """
+        return self.stats.mean, self.stats.std()
+
+    @property
+    def results(self):
+        if self.data is None:
+            return [[] for _ in range(self.runs)]
+        return [self.data[run, :self.counts[run]].tolist() for run in range(self.runs)]
+
+    def state(self):
+        return {'results': self.data[:, :self.counts.max()] if self.data is not None else None,
+                'counts': self.counts}
+
+    def load_state(self, state):
+        self.__init__(self.runs, self.info, self.capacity)
+        if state['results'] is None:
+            return
+        for run in range(self.runs):
+            for result in state['results'][run, :state['counts'][run]]:
+                self.add_result(run, result)
 
     def print_statistics(self, run=None):
         if run is not None:
-            result = 100 * torch.tensor(self.results[run])
-            argmax = result[:, 1].argmax().item()
+            argmax = self.best_row[run]
             print(f'Run {run + 1:02d}:')
-            print(f'Highest Train: {result[:, 0].max():.2f}')
-            print(f'Highest Valid: {result[:, 1].max():.2f}')
-            print(f'  Final Train: {result[argmax, 0]:.2f}')
-            for i in range(result.shape[1]-2):
-                print(f'   Final Test {i}: {result[argmax, i+2]:.2f}')
+            print(f'Highest Train: {self.highest_train[run]:.2f}')
+            print(f'Highest Valid: {self.best_valid[run]:.2f}')
+            print(f'  Final Train: {argmax[0]:.2f}')
+            for i in range(argmax.shape[0]-2):
+                print(f'   Final Test {i}: {argmax[i+2]:.2f}')
         else:
-            result = 100 * torch.tensor(self.results)
-
-            best_results = []
-            for r in result:
-                train1 = r[:, 0].max().item()
-                valid = r[:, 1].max().item()
-                train2 = r[r[:, 1].argmax(), 0].item()
-                result_list = [train1, valid, train2]
-                result_list += [r[r[:, 1].argmax(), i+2].item() for i in range(r.shape[1]-2)]
-                best_results.append(result_list)
-
-            best_result = torch.tensor(best_results)
+            # runs may have stopped early, pad them with nan
+            table = self.data[:, :self.counts.max()].clone()
+            table[torch.arange(table.shape[1]).unsqueeze(0) >= self.counts.unsqueeze(1)] = float('nan')
+            best_result = best_results(table)
 
             print(f'All runs:')
             r = best_result[:, 0]
@@ -56,6 +145,7 @@ class SimpleLogger(object):
         self.results = defaultdict(dict)
         self.param_names = tuple(param_names)
         self.used_args = list()
+        self.stats = dict()  # args -> running stats of the values over the runs
         self.desc = desc
         self.num_values = num_values
     
@@ -63,19 +153,16 @@ class SimpleLogger(object):
         """Takes run=int, args=tuple, value=tuple(float)"""
         assert(len(args) == len(self.param_names))
         assert(len(values) == self.num_values)
-        self.results[run][args] = values
-        if args not in self.used_args:
+        if args not in self.stats:
             self.used_args.append(args)
+            self.stats[args] = RunningStats(self.num_values)
+        if args in self.results[run]:
+            self.stats[args].remove(100 * torch.tensor(self.results[run][args]))
+        self.results[run][args] = values
+        self.stats[args].add(100 * torch.tensor(values))
     
     def get_best(self, top_k=1):
-        all_results = []
-        for args in self.used_args:
-            results = [i[args] for i in self.results.values() if args in i]
-            results = torch.tensor(results)*100
-            results_mean = results.mean(dim=0)[-1]
-            results_std = results.std(dim=0)
-
-            all_results.append((args, results_mean))
+        all_results = [(args, self.stats[args].mean[-1].item()) for args in self.used_args]
         results = sorted(all_results, key=lambda x: x[1], reverse=True)[:top_k]
         return [i[0] for i in results]
             
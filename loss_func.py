@@ -1,9 +1,14 @@
 import torch
 import math
-import gpytorch
 import torch.nn.functional as F
 
 
+def gp_kernels():
+    # gpytorch is slow to import and only needed by the HSIC losses
+    import gpytorch
+    return gpytorch.kernels
+
+
 class CudaCKA(object):
     def __init__(self, device):
         self.device = device
@@ -19,25 +24,27 @@ class CudaCKA(object):
         # L_X = torch.matmul(X, X.T)
         # L_Y = torch.matmul(Y, Y.T)
         # L_X = gpytorch.kernels.Linear
-        covar_module = gpytorch.kernels.LinearKernel().cuda()
-        L_X = covar_module(X).to_dense()
-        L_Y = covar_module(Y).to_dense()
-        return torch.sum(self.centering(L_X) * self.centering(L_Y))
+        # sum(H L_X H * H L_Y H) with L = v X X^T is v^2 ||Xc^T Yc||_F^2 for the
+        # column-centered Xc, Yc, no n x n matrices are needed
+        variance = gp_kernels().LinearKernel().to(self.device).variance.squeeze()
+        X_c = X - X.mean(dim=0, keepdim=True)
+        Y_c = Y - Y.mean(dim=0, keepdim=True)
+        return variance ** 2 * torch.sum(torch.matmul(X_c.T, Y_c) ** 2)
 
     def rbf_HSIC(self, X, Y, sigma):
-        covar_module = gpytorch.kernels.RBFKernel().cuda()
+        covar_module = gp_kernels().RBFKernel().to(self.device)
         L_X = covar_module(X).to_dense()
         L_Y = covar_module(Y).to_dense()
         return torch.sum(self.centering(L_X) * self.centering(L_Y))
 
     def poly_HSIC(self, X, Y, p=2):
-        covar_module = gpytorch.kernels.PolynomialKernel(power=2).cuda()
+        covar_module = gp_kernels().PolynomialKernel(power=2).to(self.device)
         L_X = covar_module(X).to_dense()
         L_Y = covar_module(Y).to_dense()
         return torch.sum(self.centering(L_X) * self.centering(L_Y))
 
     def rq_HSIC(self, X, Y):
-        covar_module = gpytorch.kernels.RQKernel().cuda()
+        covar_module = gp_kernels().RQKernel().to(self.device)
         L_X = covar_module(X).to_dense()
         L_Y = covar_module(Y).to_dense()
         return torch.sum(self.centering(L_X) * self.centering(L_Y))
@@ -0,0 +1,120 @@
+""" Evaluation metrics computed in torch on the device of the predictions.
+
+The batched metrics take y_true [..., n, t] and y_pred [..., n, c] and return
+one value per leading index, so that all environments of EnvironmentBatch are
+scored at once. The eval_* functions are drop-in eval_func replacements for
+evaluate_whole_graph that return python floats.
+"""
+import torch
+
+
+def accuracy(y_true, y_pred):
+    y_true = y_true.to(y_pred.device)
+    correct = y_pred.argmax(dim=-1) == y_true[..., 0]
+    return correct.to(torch.float).mean(dim=-1)
+
+
+def f1_score(y_true, y_pred, average='weighted'):
+    """ weighted or macro F1 from a per-class confusion matrix, like sklearn
+    the macro average is taken over the classes present in y_true or y_pred
+    """
+    y_true = y_true.to(y_pred.device)[..., 0].long()
+    pred = y_pred.argmax(dim=-1)
+    c = y_pred.shape[-1]
+    lead, n = pred.shape[:-1], pred.shape[-1]
+    R = pred.numel() // n
+    offset = (torch.arange(R, device=pred.device) * c * c).unsqueeze(1)
+    idx = offset + y_true.reshape(R, n) * c + pred.reshape(R, n)
+    conf = torch.bincount(idx.flatten(), minlength=R * c * c).view(R, c, c).to(torch.float)
+
+    tp = conf.diagonal(dim1=1, dim2=2)
+    support = conf.sum(dim=2)
+    predicted = conf.sum(dim=1)
+    f1 = 2 * tp / (support + predicted).clamp(min=1)
+    if average == 'weighted':
+        score = (f1 * support).sum(dim=1) / support.sum(dim=1)
+    elif average == 'macro':
+        present = ((support + predicted) > 0).to(torch.float)
+        score = (f1 * present).sum(dim=1) / present.sum(dim=1)
+    else:
+        raise ValueError('Invalid average')
+    return score.view(lead)
+
+
+def _average_ranks(score):
+    """ 1-based ranks along the last dim of score [R, n], ties get their average rank """
+    R, n = score.shape
+    sorted_score, order = score.sort(dim=-1)
+    new_group = torch.ones_like(sorted_score, dtype=torch.bool)
+    new_group[:, 1:] = sorted_score[:, 1:] != sorted_score[:, :-1]
+    group = new_group.cumsum(dim=-1) - 1 + (torch.arange(R, device=score.device) * n).unsqueeze(1)
+    group = group.flatten()
+    position = torch.arange(1, n + 1, device=score.device, dtype=torch.float64).repeat(R)
+    total = torch.zeros(R * n, device=score.device, dtype=torch.float64).index_add_(0, group, position)
+    count = torch.zeros(R * n, device=score.device, dtype=torch.float64).index_add_(0, group, torch.ones_like(position))
+    avg = (total / count.clamp(min=1))[group].view(R, n)
+    return torch.empty_like(avg).scatter_(1, order, avg)
+
+
+def rocauc(y_true, y_pred):
+    """ ROC-AUC averaged over the label columns, adapted from ogb.
+    Every column of every leading index is scored at once by the rank-sum
+    (Mann-Whitney) formula, unlabeled entries are pushed behind all labeled
+    ones so they do not change the ranks. Columns without both classes are
+    skipped, nan is returned where no column is valid.
+    """
+    y_true = y_true.to(y_pred.device)
+    if y_true.shape[-1] == 1:
+        # use the predicted class for single-class classification
+        y_pred = torch.softmax(y_pred, dim=-1)[..., 1:2]
+    pos = y_true == 1
+    neg = y_true == 0
+    score = y_pred.to(torch.float64).masked_fill(~(pos | neg), float('inf'))
+
+    lead, n = score.shape[:-2], score.shape[-2]
+    score = score.transpose(-1, -2).reshape(-1, n)
+    pos = pos.transpose(-1, -2).reshape(-1, n)
+    neg = neg.transpose(-1, -2).reshape(-1, n)
+
+    ranks = _average_ranks(score)
+    num_pos = pos.sum(dim=-1).to(torch.float64)
+    num_neg = neg.sum(dim=-1).to(torch.float64)
+    auc = ((ranks * pos).sum(dim=-1) - num_pos * (num_pos + 1) / 2) / (num_pos * num_neg)
+    valid = (num_pos > 0) & (num_neg > 0)
+    auc = auc.masked_fill(~valid, 0).view(*lead, -1)
+    valid = valid.view(*lead, -1)
+    return (auc.sum(dim=-1) / valid.sum(dim=-1)).to(torch.float)
+
+
+def macro_f1_score(y_true, y_pred):
+    return f1_score(y_true, y_pred, average='macro')
+
+
+def eval_acc(y_true, y_pred):
+    return accuracy(y_true, y_pred).item()
+
+
+def eval_f1(y_true, y_pred):
+    return f1_score(y_true, y_pred, average='weighted').item()
+
+
+def eval_macro_f1(y_true, y_pred):
+    return f1_score(y_true, y_pred, average='macro').item()
+
+
+def eval_rocauc(y_true, y_pred):
+    score = rocauc(y_true, y_pred).item()
+    if score != score:
+        raise RuntimeError(
+            'No positively labeled data available. Cannot compute ROC-AUC.')
+    return score
+
+
+# eval_func -> batched metric, used by evaluate_whole_graph
+batched_metrics = {
+    eval_acc: accuracy,
+    eval_f1: f1_score,
+    eval_macro_f1: macro_f1_score,
+    eval_rocauc: rocauc,
+}
+
@@ -1,5 +1,8 @@
+import contextlib
 from copy import copy
 from loss_func import CudaCKA
+from profiling import timed
+from ann_index import LSHIndex, random_candidates, sample_edits, sample_flips, edge_similarity
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -19,6 +22,50 @@ def gcn_conv(x, edge_index):
     adj = SparseTensor(row=col, col=row, value=value, sparse_sizes=(N, N))
     return matmul(adj, x) # [N, D]
 
+# the modules of the models that --compile compiles
+COMPILED = ['gnn', 'cls', 'e_cls', 'ir_cls', 'ir_Learner', 're_Learner', 'decoder']
+
+
+def compile_modules(model):
+    """ compiles the forward and backward of the backbone and the heads of
+    model in place (the state dict keys do not change). shapes are specialized
+    until they change, e.g. the edge count of an edited graph, which recompiles
+    with that dimension dynamic. graph breaks and failed compiles run eagerly
+    """
+    for name in COMPILED:
+        if hasattr(model, name):
+            compile_forward(getattr(model, name))
+    for cls in getattr(model, 'dif_cls', []):
+        compile_forward(cls)
+
+
+def compile_forward(module):
+    compiled = torch.compile(module.forward)
+
+    def forward(*args, **kwargs):
+        # (re)compiles happen during the calls, the settings only hold for them
+        with compile_settings():
+            return compiled(*args, **kwargs)
+    module.forward = forward
+
+
+@contextlib.contextmanager
+def compile_settings():
+    import logging
+    import torch._dynamo
+    # the conv code is shared by every layer of every module and guarded per layer and grad mode
+    cache_size_limit = max(torch._dynamo.config.cache_size_limit, 64)
+    # inductor logs its failed vectorization attempts as fatal before it falls back to scalar code
+    logger = logging.getLogger('torch._inductor.scheduler')
+    level = logger.level
+    logger.setLevel(logging.CRITICAL + 1)
+    try:
+        with torch._dynamo.config.patch(suppress_errors=True, cache_size_limit=cache_size_limit):
+            yield
+    finally:
+        logger.setLevel(level)
+
+
 class GraphConvolutionBase(nn.Module):
 
     def __init__(self, in_features, out_features, residual=False):
@@ -53,7 +100,8 @@ class Base(nn.Module):
                            out_channels=args.hidden_channels,
                            num_layers=args.num_layers,
                            dropout=args.dropout,
-                           use_bn=not args.no_bn)
+                           use_bn=not args.no_bn,
+                           grad_checkpoint=args.grad_checkpoint)
             #self.gnn = GraphConvolutionBase(in_features = d, out_features= args.hidden_channels)
         elif gnn == 'sage':
             self.gnn = SAGE(in_channels=d,
@@ -67,7 +115,8 @@ class Base(nn.Module):
                            out_channels=args.hidden_channels,
                            num_layers=args.num_layers,
                            dropout=args.dropout,
-                           heads=args.gat_heads)
+                           heads=args.gat_heads,
+                           chunk_size=args.gat_chunk)
         elif gnn == 'gpr':
             self.gnn = GPRGNN(in_channels=d,
                               hidden_channels=args.hidden_channels,
@@ -82,12 +131,15 @@ class Base(nn.Module):
                              num_layers=args.num_layers,
                              dropout=args.dropout,
                              alpha=args.gcnii_alpha,
-                             lamda=args.gcnii_lamda)
+                             lamda=args.gcnii_lamda,
+                             grad_checkpoint=args.grad_checkpoint)
         self.n = n
         self.device = device
         self.gnn_name = gnn
         self.args = args
         self.cls = Node_Cls(args.hidden_channels, args.hidden_channels, c, device)
+        if args.compile:
+            compile_modules(self)
 
     def reset_parameters(self):
         self.gnn.reset_parameters()
@@ -129,9 +181,9 @@ class Base(nn.Module):
                 true_label = F.one_hot(y, y.max() + 1).squeeze(1)
             else:
                 true_label = y
-            loss = criterion(pred, true_label.squeeze(1).to(torch.float))
+            loss = criterion(pred.float(), true_label.squeeze(1).to(torch.float))
         else:
-            out = F.log_softmax(pred, dim=1)
+            out = F.log_softmax(pred.float(), dim=1)
             target = y.squeeze(1)
             loss = criterion(out, target)
         return loss
@@ -271,7 +323,8 @@ class Ir_Learner(nn.Module):
                            out_channels=args.hidden_channels,
                            num_layers=args.num_layers,
                            dropout=args.dropout,
-                           use_bn=not args.no_bn)
+                           use_bn=not args.no_bn,
+                           grad_checkpoint=args.grad_checkpoint)
         elif gnn == 'sage':
             self.gnn = SAGE(in_channels=d,
                             hidden_channels=args.hidden_channels,
@@ -284,7 +337,8 @@ class Ir_Learner(nn.Module):
                            out_channels=args.hidden_channels,
                            num_layers=args.num_layers,
                            dropout=args.dropout,
-                           heads=args.gat_heads)
+                           heads=args.gat_heads,
+                           chunk_size=args.gat_chunk)
         elif gnn == 'gpr':
             self.gnn = GPRGNN(in_channels=d,
                               hidden_channels=args.hidden_channels,
@@ -299,7 +353,8 @@ class Ir_Learner(nn.Module):
                              num_layers=args.num_layers,
                              dropout=args.dropout,
                              alpha=args.gcnii_alpha,
-                             lamda=args.gcnii_lamda)
+                             lamda=args.gcnii_lamda,
+                             grad_checkpoint=args.grad_checkpoint)
         self.p = 0.2
         self.n = n
         self.d = d
@@ -310,6 +365,8 @@ class Ir_Learner(nn.Module):
         self.re_Learner = relavant_Learner(d, args.hidden_channels, args.hidden_channels, device)
         self.decoder = Decoder(args.hidden_channels + args.hidden_channels + 1, args.hidden_channels, d, device)
         self.ir_cls = Ir_Cls(args.hidden_channels, args.hidden_channels, c, device)
+        if args.compile:
+            compile_modules(self)
 
     def reset_parameters(self):
         self.gnn.reset_parameters()
@@ -343,9 +400,9 @@ class Ir_Learner(nn.Module):
                 true_label = F.one_hot(y, y.max() + 1).squeeze(1)
             else:
                 true_label = y
-            loss = criterion(pred, true_label.squeeze(1).to(torch.float))
+            loss = criterion(pred.float(), true_label.squeeze(1).to(torch.float))
         else:
-            out = F.log_softmax(pred, dim=1)
+            out = F.log_softmax(pred.float(), dim=1)
             target = y.squeeze(1)
             loss = criterion(out, target)
         return loss
@@ -360,7 +417,8 @@ class Model(nn.Module):
                            out_channels=args.hidden_channels,
                            num_layers=args.num_layers,
                            dropout=args.dropout,
-                           use_bn=not args.no_bn)
+                           use_bn=not args.no_bn,
+                           grad_checkpoint=args.grad_checkpoint)
         elif gnn == 'sage':
             self.gnn = SAGE(in_channels=d,
                             hidden_channels=args.hidden_channels,
@@ -373,7 +431,8 @@ class Model(nn.Module):
                            out_channels=args.hidden_channels,
                            num_layers=args.num_layers,
                            dropout=args.dropout,
-                           heads=args.gat_heads)
+                           heads=args.gat_heads,
+                           chunk_size=args.gat_chunk)
         elif gnn == 'gpr':
             self.gnn = GPRGNN(in_channels=d,
                               hidden_channels=args.hidden_channels,
@@ -388,7 +447,8 @@ class Model(nn.Module):
                              num_layers=args.num_layers,
                              dropout=args.dropout,
                              alpha=args.gcnii_alpha,
-                             lamda=args.gcnii_lamda)
+                             lamda=args.gcnii_lamda,
+                             grad_checkpoint=args.grad_checkpoint)
         self.p = 0.2
         self.n = n
         self.d = d
@@ -396,8 +456,16 @@ class Model(nn.Module):
         self.device = device
         self.gnn_name = gnn
         self.args = args
-        self.adj_continuous = torch.nn.parameter.Parameter(torch.FloatTensor(n, n)).to(self.device)
-        self.adj_continuous.data.fill_(0)
+        self.inv_feature = None
+        if args.mode in ('ann', 'free'):
+            # edits are proposed without gradients, no n x n tensors
+            self.adj_continuous = None
+            if args.mode == 'ann':
+                self.ann_index = LSHIndex(num_bits=args.ann_bits, num_tables=args.ann_tables,
+                                          window=args.ann_window, drift=args.ann_drift)
+        else:
+            self.adj_continuous = torch.nn.parameter.Parameter(torch.FloatTensor(n, n)).to(self.device)
+            self.adj_continuous.data.fill_(0)
         self.ir_Learner = irrelavant_Learner(d, args.hidden_channels, args.hidden_channels, device)
         self.re_Learner = relavant_Learner(d, args.hidden_channels, args.hidden_channels, device)
         self.e_cls = Environment_Cls(args.hidden_channels, args.hidden_channels, args.e, device)
@@ -408,6 +476,8 @@ class Model(nn.Module):
         for i in range(args.e):
             cls = Node_Cls(args.hidden_channels, args.hidden_channels, c, device).to(self.device)
             self.dif_cls.append(cls)
+        if args.compile:
+            compile_modules(self)
 
     def reset_parameters(self):
         self.gnn.reset_parameters()
@@ -429,7 +499,7 @@ class Model(nn.Module):
         ir_feature = self.ir_Learner(x, edge_index)
         e_new = self.e_cls(ir_feature)
         Loss = []
-        scale = torch.tensor(1.).cuda().requires_grad_()
+        scale = torch.tensor(1.).to(self.device).requires_grad_()
         if step == 1:
 
             out = self.gnn(x, edge_index).to(self.device)
@@ -470,7 +540,9 @@ class Model(nn.Module):
             env_feature = self.ir_Learner(x, edge_index)
             inv_feature = self.gnn(x, edge_index)
             rebuiled_x = self.decoder(torch.cat([env_feature, inv_feature], dim=1), edge_index)
-            ind_loss = HSIC(self.args, env_feature, inv_feature, 0, 0)
+            # the kernels and their centering stay in fp32 under --precision bf16
+            with torch.autocast(self.device.type, enabled=False):
+                ind_loss = HSIC(self.args, env_feature.float(), inv_feature.float(), 0, 0)
             return ind_loss, rebuiled_x
         if step == 4:  # calculate penalty to update ro
             x, y = data.graph['node_feat'].to(self.device), data.label.to(self.device)
@@ -505,8 +577,11 @@ class Model(nn.Module):
             Loss_env = []
             out_env = []
             for i in range(self.e):
-                out = self.gnn(x, self.env_adj[i])
-                out = self.cls(out)
+                if self.args.grad_checkpoint:
+                    # only the logits of an environment are kept for backward
+                    out = checkpointed(self, self.env_logits, x, self.env_adj[i])
+                else:
+                    out = self.env_logits(x, self.env_adj[i])
                 out_env.append(out)
             # penalty_var
             if self.args.var_type == 'ene':
@@ -536,6 +611,7 @@ class Model(nn.Module):
             fine_out = self.gnn(x, edge_index)
             fine_out = self.cls(fine_out)
             out = self.gnn(x, edge_index).to(self.device)
+            self.inv_feature = out.detach()  # reused by the gradient-free edits of step 6
             for i in range(self.e):
                 dif_out = self.dif_cls[i](out)
                 if self.args.dataset == 'elliptic':
@@ -553,22 +629,47 @@ class Model(nn.Module):
             target = Mean + penalty * self.args.penalty_weight + Var * self.args.beta
             return target
         if step == 6:
+            if self.args.mode == 'ann':
+                # Bk = torch.mm(ir_feature, ir_feature.T), restricted to the top-m ANN candidates
+                self.ann_index.update(ir_feature)
+                # like adj the existing edges are candidates too, sampled ones are removed
+                cand, score = self.ann_index.query(ir_feature, edge_index, self.args.ann_topm)
+                edge_score = edge_similarity(ir_feature, edge_index)
+                for i in range(self.e):
+                    self.env_adj[i] = sample_flips(cand, score, edge_index, edge_score, self.args.num_sample)
+                return
+            if self.args.mode == 'free':
+                # gradient-free stand-in for Bk = clamp(d loss / d A_kj, 0, 1) of --mode adj,
+                # loss = ce_loss + niu * l2_loss of environment i. the edit j -> k mixes x_j into
+                # the input of k and moves its partition p_k toward p_j, so ce_k = -log p_k[i]
+                # changes by about (p_k[i] - p_j[i]) / p_k[i]. 1 / p_k[i] is the same for all
+                # candidates of k and only scales the softmax of sample_edits, and as in adj
+                # only the loss increasing part is kept: clamp(p_k[i] - p_j[i], 0, 1). l2_loss
+                # grows with the squared distance of the invariant features of k and j
+                inv_feature = self.inv_feature
+                if inv_feature is None or inv_feature.shape[0] != self.n:
+                    with torch.no_grad():
+                        inv_feature = self.gnn(x, edge_index)
+                partition = torch.softmax(e_new.detach().float(), dim=1)
+                cand, invalid = random_candidates(self.n, self.args.free_candidates, edge_index, self.device)
+                dist = (inv_feature.unsqueeze(1) - inv_feature[cand]).pow(2).mean(dim=-1)
+                for i in range(self.e):
+                    disagree = (partition[:, i].unsqueeze(1) - partition[cand, i]).clamp(min=0)
+                    score = (disagree + dist * self.args.niu).masked_fill(invalid, float('-inf'))
+                    adj_add = sample_edits(cand, score, self.args.num_sample)
+                    self.env_adj[i] = torch.cat([edge_index, adj_add], dim=1)
+                return
             if self.args.mode == 'x':
                 x.requires_grad_(True)
                 x.retain_grad()
             Loss = []
             for i in range(self.e):
                 self.adj_continuous.data = torch.eye(self.n).to(self.device)
-                env_feature = self.ir_Learner(self.adj_continuous @ x, self.env_adj[i])
-                env_partition = self.e_cls(env_feature)
-                inv_feature_before = self.gnn(x, edge_index)
-                inv_feature_now = self.gnn(self.adj_continuous @ x, self.env_adj[i])
-                CEloss = nn.CrossEntropyLoss()
-                target = torch.full((self.n,), i).to(self.device)
-                # target = F.one_hot(target)
-                ce_loss = CEloss(env_partition, target)
-                l2_loss = F.mse_loss(inv_feature_now, inv_feature_before)
-                loss = ce_loss + l2_loss*self.args.niu
+                if self.args.grad_checkpoint:
+                    # the graph of an environment is recomputed by the backward to adj_continuous
+                    loss = checkpointed(self, self.edit_loss, x, edge_index, i)
+                else:
+                    loss = self.edit_loss(x, edge_index, i)
                 if self.args.mode == 'adj':
                     num_sample = self.args.num_sample
                     n = self.n
@@ -600,6 +701,22 @@ class Model(nn.Module):
                     x_new[row_idx, S] = 0
                     x_new = torch.mul(x_new, x).detach()
 
+    def env_logits(self, x, env_edge_index):
+        return self.cls(self.gnn(x, env_edge_index))
+
+    def edit_loss(self, x, edge_index, i):
+        """ loss of environment i that step 6 differentiates w.r.t. the edits """
+        env_feature = self.ir_Learner(self.adj_continuous @ x, self.env_adj[i])
+        env_partition = self.e_cls(env_feature)
+        inv_feature_before = self.gnn(x, edge_index)
+        inv_feature_now = self.gnn(self.adj_continuous @ x, self.env_adj[i])
+        CEloss = nn.CrossEntropyLoss()
+        target = torch.full((self.n,), i).to(self.device)
+        # target = F.one_hot(target)
+        ce_loss = CEloss(env_partition.float(), target)
+        l2_loss = F.mse_loss(inv_feature_now.float(), inv_feature_before.float())
+        return ce_loss + l2_loss*self.args.niu
+
     def importance(self, x, y, edge_index, data, criterion):
 
         out = self.gnn(x, edge_index)
@@ -625,9 +742,9 @@ class Model(nn.Module):
                 true_label = F.one_hot(y, y.max() + 1).squeeze(1)
             else:
                 true_label = y
-            loss = criterion(pred, true_label.squeeze(1).to(torch.float))
+            loss = criterion(pred.float(), true_label.squeeze(1).to(torch.float))
         else:
-            out = F.log_softmax(pred, dim=1)
+            out = F.log_softmax(pred.float(), dim=1)
             target = y.squeeze(1)
             loss = criterion(out, target)
         return loss
@@ -635,14 +752,15 @@ class Model(nn.Module):
     def CELoss_no_sum(self, logits, target):
         # logits: [N, C], target: [N, 1]
         # loss = sum(-y_i * log(c_i))
-        logits = F.log_softmax(logits, 1)
+        logits = F.log_softmax(logits.float(), 1)
         logits = logits.gather(1, target)
         loss_no_sum = -1 * logits
         return loss_no_sum
 
 
+@timed('hsic')
 def HSIC(args, xo, xc, o_logs, c_logs):
-    cka = CudaCKA(device=args.device)
+    cka = CudaCKA(device=xo.device if torch.is_tensor(xo) else o_logs.device)
     if args.kernel == 'rbf':
         if args.idp_type == 'xo':
             idp_loss = cka.rbf_CKA(xo, xc, sigma=None)
@@ -1,3 +1,7 @@
+import contextlib
+import functools
+import warnings
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -5,13 +9,60 @@ from torch.nn.parameter import Parameter
 from torch_sparse import SparseTensor, matmul
 from torch_geometric.nn import GCNConv, SAGEConv, GATConv, APPNP, MessagePassing
 from torch_geometric.nn.conv.gcn_conv import gcn_norm
+from torch_geometric.utils import remove_self_loops, add_self_loops
+from torch.utils.checkpoint import checkpoint
+from torch.utils.weak import WeakIdKeyDictionary
 import scipy.sparse
 import numpy as np
 import math
 
+
+@contextlib.contextmanager
+def frozen_batchnorm(module):
+    """ batchnorm layers of module update copies of their running stats """
+    bns = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.track_running_stats]
+    saved = [(m.running_mean, m.running_var, m.num_batches_tracked) for m in bns]
+    # swapped rather than restored in place, autograd saved the originals
+    for m, (mean, var, count) in zip(bns, saved):
+        m.running_mean, m.running_var, m.num_batches_tracked = mean.clone(), var.clone(), count.clone()
+    try:
+        yield
+    finally:
+        for m, (mean, var, count) in zip(bns, saved):
+            m.running_mean, m.running_var, m.num_batches_tracked = mean, var, count
+
+
+_checkpoint_depth = 0
+
+
+def checkpointed(module, fn, *inputs):
+    """ fn(*inputs) without keeping its activations for backward, they are
+    recomputed in the backward pass with the same dropout masks. the
+    recomputation does not update the batchnorm running stats of module again.
+    inside a checkpointed fn it just calls fn, the enclosing region is recomputed
+    as a whole
+    """
+    if _checkpoint_depth > 0:
+        return fn(*inputs)
+    calls = []
+
+    def run(*inputs):
+        global _checkpoint_depth
+        calls.append(None)
+        _checkpoint_depth += 1
+        try:
+            if len(calls) == 1:
+                return fn(*inputs)
+            with frozen_batchnorm(module):
+                return fn(*inputs)
+        finally:
+            _checkpoint_depth -= 1
+    return checkpoint(run, *inputs, use_reentrant=False)
+
+
 class GCN(nn.Module):
     def __init__(self, in_channels, hidden_channels, out_channels, num_layers,
-                 dropout, save_mem=True, use_bn=True):
+                 dropout, save_mem=True, use_bn=True, grad_checkpoint=False):
         super(GCN, self).__init__()
 
         self.convs = nn.ModuleList()
@@ -29,6 +80,7 @@ class GCN(nn.Module):
         self.dropout = dropout
         self.activation = F.relu
         self.use_bn = use_bn
+        self.grad_checkpoint = grad_checkpoint
 
     def reset_parameters(self):
         for conv in self.convs:
@@ -36,14 +88,24 @@ class GCN(nn.Module):
         for bn in self.bns:
             bn.reset_parameters()
 
+    def layer(self, i, x, edge_index, edge_weight=None):
+        x = self.convs[i](x, edge_index, edge_weight)
+        if self.use_bn:
+            x = self.bns[i](x)
+        x = self.activation(x)
+        x = F.dropout(x, p=self.dropout, training=self.training)
+        return x
 
     def forward(self, x, edge_index, edge_weight=None):
+        # with grad_checkpoint only the layer outputs are kept for backward
+        recompute = self.grad_checkpoint and self.training and torch.is_grad_enabled()
         for i, conv in enumerate(self.convs[:-1]):
-            x = conv(x, edge_index, edge_weight)
-            if self.use_bn:
-                x = self.bns[i](x)
-            x = self.activation(x)
-            x = F.dropout(x, p=self.dropout, training=self.training)
+            if recompute:
+                x = checkpointed(self, self.layer, i, x, edge_index, edge_weight)
+            else:
+                x = self.layer(i, x, edge_index, edge_weight)
+        if recompute:
+            return checkpointed(self, self.convs[-1], x, edge_index)
         x = self.convs[-1](x, edge_index)
         return x
 
@@ -88,25 +150,119 @@ class SAGE(nn.Module):
         return x
 
 
+def dst_sorted_edges(edge_index, num_nodes):
+    """ (src, dst) of edge_index with one self loop per node (as GATConv adds
+    them), sorted by destination """
+    edge_index, _ = remove_self_loops(edge_index)
+    edge_index, _ = add_self_loops(edge_index, num_nodes=num_nodes)
+    dst, perm = edge_index[1].sort(stable=True)
+    return edge_index[0][perm], dst
+
+
+class ChunkedGATConv(GATConv):
+    """ GATConv attending over chunk_size edges at a time.
+
+    The edges are sorted by destination and every chunk updates a running max,
+    softmax denominator and weighted sum of the destinations it covers (online
+    softmax), so at most chunk_size x heads x channels messages exist at once.
+    When training the chunks are recomputed in backward rather than kept.
+    Same parameters and outputs as GATConv, for node features and edge_index
+    only (no edge features, attention dropout or residual).
+    """
+    def __init__(self, in_channels, out_channels, chunk_size=2 ** 16, **kwargs):
+        super(ChunkedGATConv, self).__init__(in_channels, out_channels, **kwargs)
+        assert self.add_self_loops and self.edge_dim is None and self.dropout == 0 and self.res is None
+        self.chunk_size = chunk_size
+
+    def chunk(self, x, alpha_src, alpha_dst, src, dst, first, max0, sum0, acc0):
+        """ softmax weighted sums of the edges src -> dst, whose destinations
+        are first, first + 1, ... the running max0, sum0 and acc0 of the first
+        destination are continued. returns the outputs of all destinations but
+        the last, and the running state of the last one
+        """
+        local = dst - first
+        num = int(local[-1]) + 1
+        score = F.leaky_relu(alpha_src[src] + alpha_dst[dst], self.negative_slope)
+        # softmax is shift invariant, the max is only there for stability
+        mx = score.new_full((num, self.heads), float('-inf')).scatter_reduce(
+            0, local.unsqueeze(1).expand_as(score), score.detach(), 'amax')
+        if max0 is not None:
+            mx[0] = torch.maximum(mx[0], max0)
+        weight = torch.exp(score - mx[local])
+        total = score.new_zeros(num, self.heads).index_add(0, local, weight)
+        message = weight.unsqueeze(-1) * x[src]
+        acc = message.new_zeros(num, self.heads, self.out_channels).index_add(0, local, message)
+        if max0 is not None:
+            scale = torch.exp(max0 - mx[0])
+            total = torch.cat([total[:1] + sum0 * scale, total[1:]])
+            acc = torch.cat([acc[:1] + acc0 * scale.unsqueeze(-1), acc[1:]])
+        out = acc[:-1] / (total[:-1].unsqueeze(-1) + 1e-16)
+        return out, mx[-1], total[-1], acc[-1]
+
+    @staticmethod
+    def finish(mx, total, acc):
+        return (acc / (total.unsqueeze(-1) + 1e-16)).unsqueeze(0)
+
+    def forward(self, x, edge_index, edges=None):
+        """ edges: dst_sorted_edges(edge_index, n) if already computed """
+        H, C = self.heads, self.out_channels
+        n = x.size(0)
+        x = self.lin(x).view(-1, H, C)
+        alpha_src = (x * self.att_src).sum(dim=-1)
+        alpha_dst = (x * self.att_dst).sum(dim=-1)
+        src, dst = dst_sorted_edges(edge_index, n) if edges is None else edges
+
+        recompute = self.training and torch.is_grad_enabled()
+        starts = list(range(0, dst.numel(), self.chunk_size))
+        firsts = dst[starts].tolist()
+        outs, last, state = [], None, None
+        for start, first in zip(starts, firsts):
+            if first != last:
+                if state is not None:  # the last destination of the previous chunk is complete
+                    outs.append(self.finish(*state))
+                state = (None, None, None)
+            chunk = (x, alpha_src, alpha_dst, src[start:start + self.chunk_size],
+                     dst[start:start + self.chunk_size], first) + tuple(state)
+            if recompute:
+                out, *state = checkpointed(self, self.chunk, *chunk)
+            else:
+                out, *state = self.chunk(*chunk)
+            outs.append(out)
+            last = first + out.size(0)
+        outs.append(self.finish(*state))
+        out = torch.cat(outs)
+
+        if self.concat:
+            out = out.view(-1, H * C)
+        else:
+            out = out.mean(dim=1)
+        if self.bias is not None:
+            out = out + self.bias
+        return out
+
+
 class GAT(nn.Module):
     def __init__(self, in_channels, hidden_channels, out_channels, num_layers=2,
-                 dropout=0.5, heads=2):
+                 dropout=0.5, heads=2, chunk_size=0):
         super(GAT, self).__init__()
+        # chunk_size > 0 bounds the per-edge attention memory, same parameters
+        Conv = GATConv if chunk_size <= 0 else functools.partial(ChunkedGATConv, chunk_size=chunk_size)
+        self.chunk_size = chunk_size
 
         self.convs = nn.ModuleList()
         self.convs.append(
-            GATConv(in_channels, hidden_channels, heads=heads, concat=True))
+            Conv(in_channels, hidden_channels, heads=heads, concat=True))
 
         self.bns = nn.ModuleList()
         self.bns.append(nn.BatchNorm1d(hidden_channels*heads))
         for _ in range(num_layers - 2):
 
             self.convs.append(
-                    GATConv(hidden_channels*heads, hidden_channels, heads=heads, concat=True) ) 
+                    Conv(hidden_channels*heads, hidden_channels, heads=heads, concat=True) ) 
             self.bns.append(nn.BatchNorm1d(hidden_channels*heads))
 
         self.convs.append(
-            GATConv(hidden_channels*heads, out_channels, heads=heads, concat=False))
+            Conv(hidden_channels*heads, out_channels, heads=heads, concat=False))
 
         self.dropout = dropout
         self.activation = F.elu 
@@ -119,14 +275,68 @@ class GAT(nn.Module):
 
 
     def forward(self, x, edge_index):
+        kwargs = {}
+        if self.chunk_size > 0:  # sorted once for all layers
+            kwargs['edges'] = dst_sorted_edges(edge_index, x.size(0))
         for i, conv in enumerate(self.convs[:-1]):
-            x = conv(x, edge_index)
+            x = conv(x, edge_index, **kwargs)
             x = self.bns[i](x)
             x = self.activation(x)
             x = F.dropout(x, p=self.dropout, training=self.training)
-        x = self.convs[-1](x, edge_index)
+        x = self.convs[-1](x, edge_index, **kwargs)
         return x
 
+class SpMM(torch.autograd.Function):
+    """ adj @ x of a CSR adj, whose transpose adj_t is given for the backward """
+    @staticmethod
+    def forward(ctx, adj, adj_t, x):
+        ctx.adj_t = adj_t
+        with torch.autocast(x.device.type, enabled=False):
+            return adj @ x
+
+    @staticmethod
+    def backward(ctx, grad):
+        with torch.autocast(grad.device.type, enabled=False):
+            return None, None, ctx.adj_t @ grad.float().contiguous()
+
+
+class GCNOperator(object):
+    """ the symmetrically normalized adjacency with self loops of a graph, in
+    CSR next to its transpose. op @ x sums the normalized messages of the
+    in-neighbors of every node (of the out-neighbors with flow
+    target_to_source) with one SpMM and no scatters, in fp32
+    """
+    def __init__(self, edge_index, num_nodes, flow='source_to_target'):
+        (row, col), norm = gcn_norm(edge_index, None, num_nodes=num_nodes)
+        if flow == 'source_to_target':
+            row, col = col, row
+        # coalescing sums duplicate edges like the scatter of propagate
+        adj = torch.sparse_coo_tensor(torch.stack([row, col]), norm, (num_nodes, num_nodes))
+        adj_t = torch.sparse_coo_tensor(torch.stack([col, row]), norm, (num_nodes, num_nodes))
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', 'Sparse CSR tensor support is in beta')
+            self.adj = adj.coalesce().to_sparse_csr()
+            self.adj_t = adj_t.coalesce().to_sparse_csr()
+
+    def __matmul__(self, x):
+        return SpMM.apply(self.adj, self.adj_t, x.float().contiguous())
+
+
+_operators = WeakIdKeyDictionary()
+
+
+def gcn_operator(edge_index, num_nodes, flow='source_to_target'):
+    """ GCNOperator of edge_index, cached as long as edge_index is alive and
+    not modified in place """
+    key = (edge_index._version, num_nodes, flow)
+    cached = _operators.setdefault(edge_index, {})
+    if key not in cached:
+        if any(k[0] != key[0] for k in cached):
+            cached.clear()
+        cached[key] = GCNOperator(edge_index, num_nodes, flow)
+    return cached[key]
+
+
 class GPR_prop(MessagePassing):
     '''
     GPRGNN, from original repo https://github.com/jianhao2016/GPRGNN
@@ -170,6 +380,16 @@ class GPR_prop(MessagePassing):
         self.temp.data[-1] = (1-self.alpha)**self.K
 
     def forward(self, x, edge_index, edge_weight=None):
+        if isinstance(edge_index, torch.Tensor) and edge_weight is None:
+            # K SpMMs with the cached CSR operator
+            adj = gcn_operator(edge_index, x.size(0))
+            hidden = x*(self.temp[0])
+            for k in range(self.K):
+                x = adj @ x
+                gamma = self.temp[k+1]
+                hidden = hidden + gamma*x
+            return hidden
+
         if isinstance(edge_index, torch.Tensor):
             edge_index, norm = gcn_norm(
                 edge_index, edge_weight, num_nodes=x.size(0), dtype=x.dtype)
@@ -246,7 +466,7 @@ class GCNIIConv(nn.Module):
 
     def forward(self, x, adj, h0 , lamda, alpha, l):
         theta = math.log(lamda/l+1)
-        hi = torch.spmm(adj, x)
+        hi = adj @ x
         support = (1-alpha)*hi+alpha*h0
         output = theta*torch.mm(support, self.weight)+(1-theta)*support
         if self.residual:
@@ -254,7 +474,8 @@ class GCNIIConv(nn.Module):
         return output
 
 class GCNII(nn.Module):
-    def __init__(self, in_channels, hidden_channels, out_channels, num_layers=2, dropout=0.5, lamda=1.0, alpha=0.1):
+    def __init__(self, in_channels, hidden_channels, out_channels, num_layers=2, dropout=0.5, lamda=1.0, alpha=0.1,
+                 grad_checkpoint=False):
         super(GCNII, self).__init__()
         self.convs = nn.ModuleList()
         for _ in range(num_layers):
@@ -266,6 +487,7 @@ class GCNII(nn.Module):
         self.dropout = dropout
         self.alpha = alpha
         self.lamda = lamda
+        self.grad_checkpoint = grad_checkpoint
 
     def reset_parameters(self):
         for conv in self.convs:
@@ -273,18 +495,23 @@ class GCNII(nn.Module):
         for fc in self.fcs:
             fc.reset_parameters()
 
+    def layer(self, i, layer_inner, adj, h0):
+        layer_inner = F.dropout(layer_inner, self.dropout, training=self.training)
+        return self.act_fn(self.convs[i](layer_inner, adj, h0, self.lamda, self.alpha, i + 1))
+
     def forward(self, x, edge_index):
-        edge_index, norm = gcn_norm(
-            edge_index, torch.ones(edge_index.size(1), dtype=torch.float).to(x.device), num_nodes=x.size(0), dtype=x.dtype)
-        adj = torch.sparse.FloatTensor(
-            edge_index, norm, (x.size(0), x.size(0)))
+        # adj[i, j] is the norm of edge i -> j
+        adj = gcn_operator(edge_index, x.size(0), flow='target_to_source')
         _layers = []
         x = F.dropout(x, self.dropout, training=self.training)
         layer_inner = self.act_fn(self.fcs[0](x))
         _layers.append(layer_inner)
+        recompute = self.grad_checkpoint and self.training and torch.is_grad_enabled()
         for i,con in enumerate(self.convs):
-            layer_inner = F.dropout(layer_inner, self.dropout, training=self.training)
-            layer_inner = self.act_fn(con(layer_inner,adj,_layers[0],self.lamda,self.alpha,i+1))
+            if recompute:
+                layer_inner = checkpointed(self, self.layer, i, layer_inner, adj, _layers[0])
+            else:
+                layer_inner = self.layer(i, layer_inner, adj, _layers[0])
         layer_inner = F.dropout(layer_inner, self.dropout, training=self.training)
         layer_inner = self.fcs[-1](layer_inner)
         return F.log_softmax(layer_inner, dim=1)
@@ -1,6 +1,8 @@
-from model import Base, Model, Ir_Learner
+import argparse
+
 
 def parse_method_base(args, dataset, n, c, d, device):
+    from model import Base
     if args.gnn == 'gcn':
         model = Base(args, n, c, d, 'gcn', device).to(device)
     elif args.gnn == 'sage':
@@ -14,6 +16,7 @@ def parse_method_base(args, dataset, n, c, d, device):
     return model
 
 def parse_method_ours(args, dataset, n, c, d, device):
+    from model import Model
     if args.gnn == 'gcn':
         model = Model(args, n, c, d, 'gcn', device).to(device)
     elif args.gnn == 'sage':
@@ -27,6 +30,7 @@ def parse_method_ours(args, dataset, n, c, d, device):
     return model
 
 def parse_method_pre(args, dataset, n, c, d, device):
+    from model import Ir_Learner
     pre_model = Ir_Learner(args, n, c, d, 'gcn', device).to(device)
     return pre_model
 
@@ -35,12 +39,14 @@ def parser_add_main_args(parser):
     parser.add_argument('--data_dir', type=str, default='../../data')  # need to be specified
     parser.add_argument('--dataset', type=str, default='cora')
     parser.add_argument('--sub_dataset', type=str, default='')
-    parser.add_argument('--device', type=int, default=0,
-                        help='which gpu to use if any (default: 0)')
     parser.add_argument('--gnn_gen', type=str, default='gcn', choices=['gcn', 'gat', 'sgc'],
                         help='random initialized gnn for data generation')
+    parser.add_argument('--reorder', type=str, default='none', choices=['none', 'rcm', 'degree'],
+                        help='renumber the nodes for locality at load time, see reorder.py')
     parser.add_argument('--rocauc', action='store_true',
                         help='set the eval function to rocauc')
+    parser.add_argument('--metric', type=str, default='acc', choices=['acc', 'f1', 'macro_f1', 'rocauc'],
+                        help='eval function, see metrics.py')
 
     # model
     parser.add_argument('--hidden_channels', type=int, default=32)
@@ -55,15 +61,27 @@ def parser_add_main_args(parser):
     # training
     parser.add_argument('--lr', type=float, default=0.01)
     parser.add_argument('--pre_epochs', type=int, default=100)
+    parser.add_argument('--pretrain_train_mode', action='store_true',
+                        help='run every iene pretraining epoch in train mode, by default only the first '
+                             'one is (later ones run in the eval mode left by the evaluation)')
     parser.add_argument('--epochs', type=int, default=200)
-    parser.add_argument('--cpu', action='store_true')
     parser.add_argument('--weight_decay', type=float, default=1e-4)
-    parser.add_argument('--runs', type=int, default=5,
-                        help='number of distinct runs')
+    parser.add_argument('--seed', type=int, default=0)
     parser.add_argument('--cached', action='store_true',
                         help='set to use faster sgc')
+    parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16'],
+                        help='bf16 autocasts the backbones, heads and decoder, '
+                             'HSIC and the losses stay fp32')
+    parser.add_argument('--grad_checkpoint', action='store_true',
+                        help='recompute the activations of the gcn/gcnii layers and of the environments '
+                             'of steps 5 and 6 in the backward pass instead of keeping them')
+    parser.add_argument('--compile', action='store_true',
+                        help='torch.compile the backbone and the heads with static shapes, '
+                             'code that does not compile runs eagerly')
     parser.add_argument('--gat_heads', type=int, default=4,
                         help='attention heads for gat')
+    parser.add_argument('--gat_chunk', type=int, default=0,
+                        help='gat attends over chunks of this many edges to bound its memory, 0 for all at once')
     parser.add_argument('--lp_alpha', type=float, default=.1,
                         help='alpha for label prop')
     parser.add_argument('--gpr_alpha', type=float, default=.1,
@@ -74,8 +92,13 @@ def parser_add_main_args(parser):
                         help='lambda for gcnii')
     parser.add_argument('--directed', action='store_true',
                         help='set to not symmetrize adjacency')
-    parser.add_argument('--display_step', type=int,
-                        default=1, help='how often to print')
+    parser.add_argument('--eval_every', type=int,
+                        default=1, help='how often to evaluate all environments')
+    parser.add_argument('--patience', type=int, default=0,
+                        help='stop the main phase after this many evaluations without a better '
+                             'valid score, 0 trains all epochs')
+    parser.add_argument('--time_budget', type=float, default=0,
+                        help='wall-clock seconds of training per run, 0 for no limit')
 
     # for graph edit model
     parser.add_argument('--e', type=int, default=3,
@@ -92,8 +115,23 @@ def parser_add_main_args(parser):
                         help='learning rate for graph edit model')
     parser.add_argument('--ir_step', type=float, default=0.005,
                         help='learning step for ir learner')
-    parser.add_argument('--mode', type=str,  default='adj',
-                        help='rebuild what kind of object of graph')
+    parser.add_argument('--mode', type=str,  default='adj', choices=['adj', 'x', 'ann', 'free'],
+                        help='rebuild what kind of object of graph, adj flips sampled adjacency entries '
+                             '(adds and removes edges), ann samples the flips among the existing edges and '
+                             'the non-edges proposed by an LSH index, free only adds random non-edges, '
+                             'scored without a backward pass')
+    parser.add_argument('--ann_topm', type=int, default=16,
+                        help='num of non-edge candidates per node for ann mode')
+    parser.add_argument('--free_candidates', type=int, default=16,
+                        help='num of random non-edge candidates per node for free mode')
+    parser.add_argument('--ann_bits', type=int, default=16,
+                        help='num of hash bits per LSH table')
+    parser.add_argument('--ann_tables', type=int, default=4,
+                        help='num of LSH tables')
+    parser.add_argument('--ann_window', type=int, default=8,
+                        help='num of neighbours on each side in the sorted codes')
+    parser.add_argument('--ann_drift', type=float, default=0.1,
+                        help='relative embedding drift that triggers an index rebuild')
     parser.add_argument('--var_type', type=str,
                         help='the inviriant penalty type')
     parser.add_argument('--penalty_weight', type=float, default=4,
@@ -115,3 +153,54 @@ def parser_add_main_args(parser):
     parser.add_argument('--pud_a_step', type=int,
                         default=5, help='penalty A update step')
 
+    parser_add_run_args(parser)
+
+
+def parser_add_run_args(parser):
+    """ args that do not change the model of a run: where and how it runs, what it
+    prints, checkpoints, profiles and the resource checks before it. They are left
+    out of the config hash of results.py, every other arg of parser_add_main_args
+    is part of it. --parallel_runs and --pretrain_cache seed every run with
+    seed + run, results.run_seeding adds that to the config """
+    parser.add_argument('--device', type=int, default=0,
+                        help='which gpu to use if any (default: 0)')
+    parser.add_argument('--cpu', action='store_true')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='number of distinct runs')
+    parser.add_argument('--pretrain_cache', type=str, default='',
+                        help='directory caching the iene pretraining state by a hash of the '
+                             'pretraining args, runs are then seeded with seed + run')
+    parser.add_argument('--checkpoint', type=str, default='',
+                        help='path of the training checkpoint, written on a background thread')
+    parser.add_argument('--checkpoint_every', type=int, default=10,
+                        help='epochs between checkpoints')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from --checkpoint if it exists')
+    parser.add_argument('--parallel_runs', type=int, default=1,
+                        help='num of CPU worker processes training runs in parallel, '
+                             'run r is seeded with seed + r')
+    parser.add_argument('--display_step', type=int,
+                        default=1, help='how often to print')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='print the estimated flops and peak memory per epoch and exit')
+    parser.add_argument('--memory_budget', type=float, default=0,
+                        help='GB, refuse configs whose estimated peak memory is larger (0: no check)')
+    parser.add_argument('--auto_scale', action='store_true',
+                        help='switch the dense --mode adj/x to ann instead of refusing when step 6 is over '
+                             '--memory_budget, the kernel is never switched')
+    parser.add_argument('--profile', type=str, default='',
+                        help='directory for per-step timings, peak memory and a chrome trace, see profiling.py')
+    parser.add_argument('--profile_trace', type=int, default=2,
+                        help='num of epochs recorded in the chrome trace')
+    parser.add_argument('--results_db', type=str, default='',
+                        help='sqlite file collecting per-epoch results of every run, see results.py')
+    parser.add_argument('--best_dir', type=str, default='',
+                        help='also save the weights of the best valid epoch of each run here')
+
+
+def config_arg_names():
+    """ the args of parser_add_main_args that make up the config of a run """
+    main_parser, run_parser = argparse.ArgumentParser(), argparse.ArgumentParser()
+    parser_add_main_args(main_parser)
+    parser_add_run_args(run_parser)
+    return sorted(set(vars(main_parser.parse_args([]))) - set(vars(run_parser.parse_args([]))))
@@ -0,0 +1,220 @@
+"""
+Opt-in profiling of IENE training (--profile DIR).
+
+Sections (the model steps, the optimizer updates, HSIC, evaluation) and the
+forward passes of the model parts are timed per epoch: wall time, process CPU
+time and peak memory (CUDA allocator peak per section, or on CPU the peak RSS
+of the epoch so far, VmHWM is only reset once per epoch). The first
+--profile_trace epochs are also recorded by torch.profiler. finish() writes
+
+    DIR/steps.csv    one row per (run, epoch, section)
+    DIR/summary.csv  totals and means over the epochs per section
+    DIR/trace.json   chrome trace, open in chrome://tracing or perfetto
+
+When profiling is off section() returns a shared null context, so the
+instrumented code only pays for a global lookup.
+"""
+import contextlib
+import csv
+import functools
+import os
+import resource
+import time
+from collections import defaultdict
+
+import torch
+
+MODULES = ['gnn', 'ir_Learner', 'decoder', 'e_cls']
+
+_profiler = None
+_null = contextlib.nullcontext()
+
+
+def rss_peak_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_rss_peak():
+    # resets VmHWM on linux, elsewhere the process peak is reported
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+class Profiler(object):
+    def __init__(self, out_dir, device, trace_epochs=2):
+        self.out_dir = out_dir
+        self.cuda = device.type == 'cuda'
+        self.trace_epochs = trace_epochs
+        self.rows = []
+        self.epoch_stats = defaultdict(lambda: [0, 0., 0., 0.])  # calls, wall, cpu, peak
+        self.stack = []
+        self.handles = []
+        self.run, self.epoch = 0, None
+        self.traced = 0
+        self.trace = None
+        if trace_epochs > 0:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.trace = torch.profiler.profile(activities=activities, profile_memory=True, record_shapes=True)
+            self.trace.__enter__()
+
+    def _sync(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+
+    def _peak(self):
+        if self.cuda:
+            return torch.cuda.max_memory_allocated() / 2 ** 20
+        return rss_peak_mb()
+
+    def enter(self, name):
+        self._sync()
+        if self.cuda:
+            if self.stack:
+                # the peak is reset per section, keep what the enclosing one saw so far
+                self.stack[-1][3] = max(self.stack[-1][3], self._peak())
+            torch.cuda.reset_peak_memory_stats()
+        record = torch.autograd.profiler.record_function(name) if self.trace is not None else None
+        if record is not None:
+            record.__enter__()
+        self.stack.append([name, time.perf_counter(), time.process_time(), 0., record])
+
+    def exit(self):
+        self._sync()
+        name, wall, cpu, peak, record = self.stack.pop()
+        if record is not None:
+            record.__exit__(None, None, None)
+        peak = max(peak, self._peak())
+        if self.stack:
+            self.stack[-1][3] = max(self.stack[-1][3], peak)
+        stats = self.epoch_stats[name]
+        stats[0] += 1
+        stats[1] += time.perf_counter() - wall
+        stats[2] += time.process_time() - cpu
+        stats[3] = max(stats[3], peak)
+
+    @contextlib.contextmanager
+    def section(self, name):
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def next_epoch(self, run, epoch):
+        self.end_epoch()
+        self.run, self.epoch = run, epoch
+        if not self.cuda:
+            reset_rss_peak()
+
+    def end_epoch(self):
+        if self.epoch is not None:
+            for name, (calls, wall, cpu, peak) in self.epoch_stats.items():
+                self.rows.append({'run': self.run, 'epoch': self.epoch, 'section': name, 'calls': calls,
+                                  'wall_s': wall, 'cpu_s': cpu, 'peak_mb': peak})
+            self.traced += 1
+            if self.trace is not None and self.traced == self.trace_epochs:
+                self.stop_trace()
+        self.epoch_stats.clear()
+        self.epoch = None
+
+    def stop_trace(self):
+        self.trace.__exit__(None, None, None)
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.trace.export_chrome_trace(os.path.join(self.out_dir, 'trace.json'))
+        self.trace = None
+
+    def watch(self, model):
+        """ times the forward passes of the parts of model """
+        parts = [(name, getattr(model, name)) for name in MODULES if hasattr(model, name)]
+        parts += [('dif_cls', cls) for cls in getattr(model, 'dif_cls', [])]
+        for name, module in parts:
+            self.handles.append(module.register_forward_pre_hook(lambda m, inputs, name=name: self.enter(name)))
+            self.handles.append(module.register_forward_hook(lambda m, inputs, output: self.exit()))
+
+    def finish(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        self.end_epoch()
+        if self.trace is not None:
+            self.stop_trace()
+        os.makedirs(self.out_dir, exist_ok=True)
+        fields = ['run', 'epoch', 'section', 'calls', 'wall_s', 'cpu_s', 'peak_mb']
+        with open(os.path.join(self.out_dir, 'steps.csv'), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+        totals = defaultdict(lambda: [0, 0, 0., 0., 0.])  # epochs, calls, wall, cpu, peak
+        for row in self.rows:
+            total = totals[row['section']]
+            total[0] += 1
+            total[1] += row['calls']
+            total[2] += row['wall_s']
+            total[3] += row['cpu_s']
+            total[4] = max(total[4], row['peak_mb'])
+        summary = sorted(([name] + values for name, values in totals.items()), key=lambda r: -r[3])
+        with open(os.path.join(self.out_dir, 'summary.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['section', 'epochs', 'calls', 'wall_s', 'cpu_s', 'wall_s_per_epoch', 'peak_mb'])
+            for name, epochs, calls, wall, cpu, peak in summary:
+                writer.writerow([name, epochs, calls, f'{wall:.6f}', f'{cpu:.6f}', f'{wall / epochs:.6f}',
+                                 f'{peak:.1f}'])
+        print(f'Profile written to {self.out_dir}')
+        print(f'{"section":>16} {"wall/epoch":>12} {"cpu/epoch":>12} {"peak MB":>10}')
+        for name, epochs, calls, wall, cpu, peak in summary:
+            print(f'{name:>16} {1000 * wall / epochs:10.2f}ms {1000 * cpu / epochs:10.2f}ms {peak:10.1f}')
+
+
+def start(out_dir, device, trace_epochs=2):
+    global _profiler
+    _profiler = Profiler(out_dir, device, trace_epochs)
+    return _profiler
+
+
+def finish():
+    global _profiler
+    if _profiler is not None:
+        _profiler.finish()
+        _profiler = None
+
+
+def section(name):
+    if _profiler is None:
+        return _null
+    return _profiler.section(name)
+
+
+def next_epoch(run, epoch):
+    if _profiler is not None:
+        _profiler.next_epoch(run, epoch)
+
+
+def watch(model):
+    if _profiler is not None:
+        _profiler.watch(model)
+
+
+def timed(name):
+    """ decorator timing every call of the function as section name """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return fn(*args, **kwargs)
+            with _profiler.section(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,86 @@
+"""
+Cache friendly node orders of the environments (--reorder).
+
+The node ids of the Planetoid / Amazon graphs are arbitrary, so the neighbor
+gathers of every SpMM and scatter jump across the feature matrix. At load
+time the nodes are renumbered with
+
+    rcm     reverse Cuthill-McKee, neighbors get close ids (small bandwidth)
+    degree  by decreasing degree, the rows read most often are packed together
+
+All environments share the graph, so one permutation is computed from the
+train environment, saved next to the environment pkls (gen/order-<order>.pt)
+and applied to the edge_index, the node features (with the spurious block)
+and the labels of every environment. dataset.perm[i] is the original id of
+node i, to_original maps node outputs back to the original ids (the test
+logits of evaluate_whole_graph(return_outs=True) are returned that way).
+"""
+import os
+
+import numpy as np
+import torch
+
+from checkpoint import save_atomic
+
+ORDERS = ['none', 'rcm', 'degree']
+
+
+def rcm_order(edge_index, num_nodes):
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import reverse_cuthill_mckee
+    row, col = edge_index.cpu().numpy()
+    adj = coo_matrix((np.ones(len(row), dtype=np.float32), (row, col)), shape=(num_nodes, num_nodes)).tocsr()
+    # symmetric_mode expects the structure of A + A^T
+    order = reverse_cuthill_mckee(adj + adj.T, symmetric_mode=True)
+    return torch.from_numpy(order.astype(np.int64))
+
+
+def degree_order(edge_index, num_nodes):
+    degree = torch.bincount(edge_index.flatten().cpu(), minlength=num_nodes)
+    return torch.argsort(degree, descending=True, stable=True)
+
+
+def node_order(order, edge_index, num_nodes):
+    """ perm of order, perm[i] is the node that gets id i """
+    if order == 'rcm':
+        return rcm_order(edge_index, num_nodes)
+    if order == 'degree':
+        return degree_order(edge_index, num_nodes)
+    raise ValueError(f'Invalid order {order}')
+
+
+def load_order(path, order, edge_index, num_nodes):
+    """ the perm saved at path, computed and saved if missing or stale """
+    if os.path.exists(path):
+        state = torch.load(path)
+        if state['num_nodes'] == num_nodes and state['num_edges'] == edge_index.shape[1]:
+            return state['perm']
+    perm = node_order(order, edge_index, num_nodes)
+    save_atomic({'order': order, 'num_nodes': num_nodes, 'num_edges': edge_index.shape[1], 'perm': perm}, path)
+    return perm
+
+
+def permute(dataset, perm):
+    """ renumbers the nodes of dataset in place, node i becomes perm[i] """
+    ids = torch.empty_like(perm)
+    ids[perm] = torch.arange(len(perm))
+    dataset.graph['edge_index'] = ids[dataset.graph['edge_index']]
+    dataset.graph['node_feat'] = dataset.graph['node_feat'][perm]
+    dataset.label = dataset.label[perm]
+    dataset.perm = perm
+
+
+def reorder_datasets(datasets, order, path):
+    dataset_tr, dataset_val, datasets_te = datasets
+    graph = dataset_tr.graph
+    perm = load_order(path, order, graph['edge_index'], graph['num_nodes'])
+    for dataset in [dataset_tr, dataset_val] + list(datasets_te):
+        permute(dataset, perm)
+
+
+def to_original(dataset, out):
+    """ rows of out (one per node of dataset) in the original node order """
+    perm = getattr(dataset, 'perm', None)
+    if perm is None:
+        return out
+    return torch.empty_like(out).index_copy_(0, perm.to(out.device), out)
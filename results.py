@@ -0,0 +1,229 @@
+"""
+Structured results store, one SQLite row per (config, run, epoch, env, metric).
+
+Rows are written by a background thread in batches, so training only pays for
+a queue put per epoch. A key (config, run, epoch, env, metric) is stored once,
+writing it again raises. A resumed run first drops its rows past the
+checkpoint, the epochs it trains again. The config table maps
+the config hash to the full args as json, summary() scores every run of every
+config at once like Logger.print_statistics.
+
+    python results.py results/results.db
+"""
+import argparse
+import hashlib
+import json
+import queue
+import sqlite3
+import threading
+
+import torch
+
+from parse import config_arg_names
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS configs (hash TEXT PRIMARY KEY, config TEXT);
+CREATE TABLE IF NOT EXISTS results (
+    hash TEXT, run INTEGER, epoch INTEGER, env INTEGER, metric TEXT, value REAL,
+    train_time REAL, eval_time REAL);
+CREATE INDEX IF NOT EXISTS results_hash ON results (hash, metric);
+CREATE UNIQUE INDEX IF NOT EXISTS results_key ON results (hash, run, epoch, env, metric);
+"""
+
+# keeps the last row of every key, for stores written before results_key
+DEDUPLICATE = """
+DELETE FROM results WHERE rowid NOT IN (SELECT MAX(rowid) FROM results GROUP BY hash, run, epoch, env, metric);
+"""
+
+# the hashed args, without the run args of parse.py and those of the scripts
+# (asha.py, benchmarks) that extend the main parser
+CONFIG_ARGS = config_arg_names()
+
+
+def run_seeding(args):
+    """ 'per_run' when every run is seeded with seed + run (--parallel_runs,
+    the iene --pretrain_cache, sweep.py), 'sequential' when main.py seeds once
+    with seed before the first run. the two give different numbers """
+    if getattr(args, 'seeding', None):
+        return args.seeding
+    if args.parallel_runs > 1 or (args.method == 'iene' and args.pretrain_cache):
+        return 'per_run'
+    return 'sequential'
+
+
+def config_of(args):
+    config = {k: v for k, v in sorted(vars(args).items()) if k in CONFIG_ARGS}
+    if run_seeding(args) != 'sequential':  # keeps the hashes of sequential configs
+        config['seeding'] = run_seeding(args)
+    if getattr(args, 'auto_scaled', None):
+        # the args switched by --auto_scale, with their original values
+        config['auto_scaled'] = args.auto_scaled
+    return config
+
+
+def config_hash(args):
+    return hashlib.sha256(json.dumps(config_of(args), sort_keys=True).encode()).hexdigest()[:16]
+
+
+def epoch_rows(key, run, epoch, accs, metric, loss=None, train_time=0., eval_time=0.):
+    """ rows of one evaluated epoch, env 0 is train, 1 valid and 2.. the test envs """
+    if torch.is_tensor(accs):
+        accs = accs.tolist()
+    rows = [(key, run, epoch, env, metric, float(acc), train_time, eval_time) for env, acc in enumerate(accs)]
+    if loss is not None:
+        rows.append((key, run, epoch, 0, 'loss', float(loss), train_time, eval_time))
+    return rows
+
+
+class ResultStore(object):
+    """ buffered writer of the results table, rows are inserted by a background thread """
+    def __init__(self, path, batch_size=1024):
+        self.path = path
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.error = None
+        with sqlite3.connect(path) as conn:
+            try:
+                conn.executescript(SCHEMA)
+            except sqlite3.IntegrityError:
+                conn.executescript(DEDUPLICATE + SCHEMA)
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self.path)
+        done = False
+        while not done:
+            items = [self.queue.get()]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = any(item is None for item in items)
+            try:
+                # one transaction, in the order of the queue
+                with conn:
+                    for item in items:
+                        if item is None:
+                            continue
+                        if item[0] == 'config':
+                            conn.execute('INSERT OR IGNORE INTO configs VALUES (?, ?)', item[1:])
+                        elif item[0] == 'truncate':
+                            conn.execute('DELETE FROM results WHERE hash = ? AND (run > ? OR run = ? AND epoch >= ?)',
+                                         (item[1], item[2], item[2], item[3]))
+                        else:
+                            conn.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)', item[1])
+            except sqlite3.IntegrityError as e:
+                self.error = ValueError(f'{self.path} already holds results of this config and run, '
+                                        f'use another --results_db or drop them ({e})')
+            except Exception as e:
+                self.error = e
+            for _ in items:
+                self.queue.task_done()
+        conn.close()
+
+    def add_config(self, args):
+        key = config_hash(args)
+        self.queue.put(('config', key, json.dumps(config_of(args), sort_keys=True)))
+        return key
+
+    def truncate(self, key, run, epoch):
+        """ drops the rows of config key from epoch of run on, and those of the
+        later runs, before a resumed run trains them again """
+        self.queue.put(('truncate', key, run, epoch))
+
+    def write(self, rows):
+        if self.error is not None:
+            raise self.error
+        if len(rows) > 0:
+            self.queue.put(('rows', list(rows)))
+
+    def flush(self):
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def load(path, metric, keys=None):
+    """ the values of metric as a [runs, epochs, envs] tensor padded with nan,
+    with the (hash, run) of every row and the epoch of every column
+    """
+    with sqlite3.connect(path) as conn:
+        query = 'SELECT hash, run, epoch, env, value FROM results WHERE metric = ?'
+        params = [metric]
+        if keys is not None:
+            query += f' AND hash IN ({",".join("?" * len(keys))})'
+            params += list(keys)
+        records = conn.execute(query, params).fetchall()
+    if len(records) == 0:
+        return torch.empty(0, 0, 0), [], []
+    hashes, runs, epochs, envs, values = zip(*records)
+    run_ids = sorted(set(zip(hashes, runs)))
+    run_index = {r: i for i, r in enumerate(run_ids)}
+    row = torch.tensor([run_index[r] for r in zip(hashes, runs)])
+    epochs, col = torch.unique(torch.tensor(epochs), return_inverse=True)
+    env = torch.tensor(envs)
+    table = torch.full((len(run_ids), len(epochs), int(env.max()) + 1), float('nan'))
+    table[row, col, env] = torch.tensor(values, dtype=torch.float)
+    return table, run_ids, epochs.tolist()
+
+
+def best_results(table):
+    """ per run [highest train, highest valid, final train, final test...] at the
+    first best valid epoch, in percent like Logger.print_statistics
+    """
+    table = 100 * table
+    evaluated = ~table[:, :, 1].isnan()
+    valid = table[:, :, 1].masked_fill(~evaluated, float('-inf'))
+    argmax = valid.argmax(dim=1)
+    final = table[torch.arange(table.shape[0]), argmax]
+    highest_train = table[:, :, 0].masked_fill(~evaluated, float('-inf')).max(dim=1).values
+    return torch.cat([highest_train.unsqueeze(1), valid.max(dim=1).values.unsqueeze(1), final[:, :1], final[:, 2:]],
+                     dim=1)
+
+
+def summary(path, metric=None, keys=None):
+    """ mean and std over the runs of every config of the best_results columns,
+    returns {hash: (config, num_runs, mean, std)}
+    """
+    with sqlite3.connect(path) as conn:
+        configs = dict(conn.execute('SELECT hash, config FROM configs').fetchall())
+        if metric is None:
+            metric = conn.execute("SELECT metric FROM results WHERE metric != 'loss' LIMIT 1").fetchone()[0]
+    table, run_ids, _ = load(path, metric, keys)
+    if len(run_ids) == 0:
+        return {}
+    best = best_results(table)
+    order = sorted(set(h for h, _ in run_ids))
+    group = torch.tensor([order.index(h) for h, _ in run_ids])
+    count = torch.bincount(group, minlength=len(order)).to(torch.float).unsqueeze(1)
+    mean = torch.zeros(len(order), best.shape[1]).index_add_(0, group, best) / count
+    sq = torch.zeros(len(order), best.shape[1]).index_add_(0, group, (best - mean[group]) ** 2)
+    std = (sq / (count - 1)).sqrt()
+    return {h: (json.loads(configs.get(h, '{}')), int(count[i]), mean[i], std[i]) for i, h in enumerate(order)}
+
+
+def print_summary(path, metric=None, keys=None):
+    for key, (config, num_runs, mean, std) in summary(path, metric, keys).items():
+        print(f'Config {key} ({num_runs} runs): '
+              + ' '.join(f'{k}={config[k]}' for k in ('method', 'dataset', 'gnn_gen', 'gnn') if k in config))
+        names = ['Highest Train', 'Highest Valid', '  Final Train'] + \
+                [f'   Final Test {i}' for i in range(len(mean) - 3)]
+        for name, m, s in zip(names, mean, std):
+            print(f'{name}: {m:.2f} ± {s:.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarize a results store')
+    parser.add_argument('db', type=str)
+    parser.add_argument('--metric', type=str, default=None)
+    parser.add_argument('--hash', type=str, nargs='*', default=None)
+    args = parser.parse_args()
+    print_summary(args.db, args.metric, args.hash)
@@ -1,3 +1,4 @@
+# the same table in one process: python sweep.py sweeps/paper.json --store results/paper.jsonl
 # cora
 python main.py --method erm --dataset cora --gnn_gen gcn --gnn gcn --run 20 --lr 0.001 --device 0
 python main.py --method erm --dataset cora --gnn_gen gcn --gnn sage --run 20 --lr 0.001 --device 0
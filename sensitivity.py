@@ -0,0 +1,85 @@
+"""
+Sensitivity analysis of the input features over all environments.
+
+The importance of feature j in an environment is the mean over its nodes of
+|d loss / d x_ij|, the loss being the supervised loss of the environment. All
+environments are stacked into the disjoint graph of evaluate_whole_graph and
+go through one forward and one backward: in eval mode no node of one
+environment influences another one, so the gradient rows of an environment
+are those of its own loss. The importances are means over the nodes, so the
+node order of --reorder does not change them. The [environments, features]
+importances are saved with the overlap metrics of the paper in one torch file.
+
+    python sensitivity.py results/cora-iene-gcn-importance.pt
+"""
+import argparse
+
+import torch
+
+from data_utils import EnvironmentBatch
+
+
+def feature_importance(model, datasets, criterion):
+    """ [2 + len(datasets_te), d] mean |d loss / d x| of the train, valid and
+    test environments of datasets = (dataset_tr, dataset_val, datasets_te) """
+    dataset_tr, dataset_val, datasets_te = datasets
+    datasets = [dataset_tr, dataset_val] + list(datasets_te)
+    env_batch = getattr(dataset_tr, 'env_batch', None)
+    if env_batch is None or not env_batch.matches(datasets, model.device):
+        env_batch = dataset_tr.env_batch = EnvironmentBatch(datasets, model.device)
+
+    model.eval()
+    x = env_batch.graph['node_feat'].detach().clone().requires_grad_(True)
+    with torch.enable_grad():
+        # the forward of model.importance, on all environments at once
+        out = model.cls(model.gnn(x, env_batch.graph['edge_index']))
+        labels = env_batch.label.split(env_batch.sizes)
+        loss = sum(model.sup_loss(y, o, criterion) for y, o in zip(labels, out.split(env_batch.sizes)))
+        grad, = torch.autograd.grad(loss, x)
+    grad = grad.abs()
+    if len(set(env_batch.sizes)) == 1:
+        return grad.view(len(datasets), env_batch.sizes[0], -1).mean(dim=1).cpu()
+    return torch.stack([g.mean(dim=0) for g in grad.split(env_batch.sizes)]).cpu()
+
+
+def env_names(num_envs):
+    return ['train', 'valid'] + [f'test {i}' for i in range(num_envs - 2)]
+
+
+def overlaps(importance, top=100, spurious=10, spurious_top=200):
+    """ per environment the share of its top features among the top features
+    of the train environment, and the share of the spurious features (the last
+    `spurious` ones, stitched by create_synthetic.py) in its top spurious_top
+    """
+    top = min(top, importance.shape[1])
+    ranked = importance.argsort(dim=1, descending=True)
+    train_top = set(ranked[0, :top].tolist())
+    first_spurious = importance.shape[1] - spurious
+    return {'top_overlap': [len(train_top & set(r[:top].tolist())) / top for r in ranked],
+            'spurious_in_top': [(r[:spurious_top] >= first_spurious).sum().item() / spurious for r in ranked]}
+
+
+def save_importance(path, importance, args=None):
+    state = {'importance': importance, 'envs': env_names(importance.shape[0])}
+    state.update(overlaps(importance))
+    if args is not None:
+        state['args'] = vars(args)
+    torch.save(state, path)
+    return state
+
+
+def print_overlaps(state):
+    print('Feature importance     top-100 overlap with train   spurious features in top 200')
+    for i, name in enumerate(state['envs']):
+        print(f'{name:>10}   {100 * state["top_overlap"][i]:26.0f}%   {100 * state["spurious_in_top"][i]:28.0f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prints the overlaps of saved feature importances')
+    parser.add_argument('path', type=str)
+    args = parser.parse_args()
+    print_overlaps(torch.load(args.path))
+
+
+if __name__ == '__main__':
+    main()
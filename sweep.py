@@ -0,0 +1,172 @@
+"""
+In-process sweep executor, replaces one `python main.py` per line of run.sh.
+
+Every (dataset, gnn_gen) environment set is loaded once in the parent and
+shared with a pool of forked CPU workers, and every (config, run) job is
+scheduled on the pool. Results are streamed to one JSON lines store, jobs
+already in the store are skipped, so an interrupted sweep can be re-run.
+--db also collects the per-epoch results in a results.py store.
+
+    python sweep.py sweeps/paper.json --workers 8 --store results/paper.jsonl
+
+A grid file holds "base" args shared by all configs and "grid", a list of
+{arg: [values]} dicts whose cartesian products are the configs.
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+
+import torch
+
+from logger import Logger
+from parse import parser_add_main_args
+from results import ResultStore
+from train import Trainer, fix_seed, load_datasets, share_datasets, get_criterion, get_eval_func
+
+
+def expand_grid(grid_file):
+    spec = json.load(open(grid_file))
+    base = spec.get('base', {})
+    grids = spec['grid'] if isinstance(spec['grid'], list) else [spec['grid']]
+    configs = []
+    for grid in grids:
+        keys = list(grid.keys())
+        for values in itertools.product(*[grid[key] for key in keys]):
+            config = dict(base)
+            config.update(zip(keys, values))
+            if config not in configs:
+                configs.append(config)
+    return configs
+
+
+def config_args(config, defaults):
+    args = argparse.Namespace(**vars(defaults))
+    for key, value in config.items():
+        if not hasattr(args, key):
+            raise ValueError(f'Unknown argument {key} in sweep config')
+        setattr(args, key, value)
+    args.cpu = True
+    args.seeding = 'per_run'  # _run_job seeds every run with seed + run
+    return args
+
+
+def config_key(config):
+    return json.dumps(config, sort_keys=True)
+
+
+def env_key(args):
+    return (args.data_dir, args.dataset, args.gnn_gen)
+
+
+def load_store(path):
+    done = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                done[(record['key'], record['run'])] = record
+    return done
+
+
+_shared = {}
+
+
+def _init_worker(environments, num_threads, counter):
+    with counter.get_lock():
+        worker_id = counter.value
+        counter.value += 1
+    torch.set_num_threads(num_threads)
+    if hasattr(os, 'sched_setaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+        cores = cpus[worker_id * num_threads:(worker_id + 1) * num_threads]
+        if len(cores) == num_threads:
+            os.sched_setaffinity(0, cores)
+    _shared['environments'] = environments
+
+
+def _run_job(job):
+    key, args, run = job
+    fix_seed(args.seed + run)
+    start = time.time()
+    trainer = Trainer(args, _shared['environments'][env_key(args)], torch.device('cpu'),
+                      get_criterion(args), get_eval_func(args), run=run, verbose=False)
+    results = trainer.fit()
+    return key, run, results, time.time() - start, trainer.rows
+
+
+def summarize(configs, done):
+    for config in configs:
+        key = config_key(config)
+        runs = sorted(run for (k, run) in done if k == key)
+        if len(runs) == 0:
+            continue
+        print(f'Config: {key}')
+        logger = Logger(len(runs))
+        for i, run in enumerate(runs):
+            for accs in done[(key, run)]['results']:
+                logger.add_result(i, accs)
+        logger.print_statistics()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep executor')
+    parser.add_argument('grid', type=str, help='json grid file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--store', type=str, default='results/sweep.jsonl')
+    parser.add_argument('--db', type=str, default='', help='sqlite results store, see results.py')
+    sweep_args = parser.parse_args()
+
+    defaults_parser = argparse.ArgumentParser()
+    parser_add_main_args(defaults_parser)
+    defaults = defaults_parser.parse_args([])
+
+    configs = expand_grid(sweep_args.grid)
+    done = load_store(sweep_args.store)
+    jobs, environments = [], {}
+    for config in configs:
+        args = config_args(config, defaults)
+        args.results_db = sweep_args.db
+        key = config_key(config)
+        runs = [run for run in range(args.runs) if (key, run) not in done]
+        if len(runs) > 0 and env_key(args) not in environments:
+            environments[env_key(args)] = load_datasets(args)
+        jobs += [(key, args, run) for run in runs]
+    print(f'{len(configs)} configs, {len(jobs)} jobs to run, {len(environments)} environment sets loaded')
+
+    for datasets in environments.values():
+        share_datasets(datasets)
+    num_workers = max(1, min(sweep_args.workers, len(jobs)))
+    num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    store_dir = os.path.dirname(sweep_args.store)
+    if store_dir:
+        os.makedirs(store_dir, exist_ok=True)
+
+    import torch.multiprocessing as mp
+    ctx = mp.get_context('fork')
+    counter = ctx.Value('i', 0)
+    db = None
+    if sweep_args.db:
+        db = ResultStore(sweep_args.db)
+        for _, args, _ in jobs:
+            db.add_config(args)
+    start = time.time()
+    with open(sweep_args.store, 'a') as store, \
+            ctx.Pool(num_workers, initializer=_init_worker, initargs=(environments, num_threads, counter)) as pool:
+        for i, (key, run, results, elapsed, rows) in enumerate(pool.imap_unordered(_run_job, jobs)):
+            if db is not None:
+                db.write(rows)
+            record = {'key': key, 'config': json.loads(key), 'run': run, 'results': results, 'time': elapsed}
+            store.write(json.dumps(record) + '\n')
+            store.flush()
+            done[(key, run)] = record
+            print(f'[{i + 1}/{len(jobs)}] run {run} of {key} in {elapsed:.1f}s')
+    if db is not None:
+        db.close()
+    print(f'Sweep finished in {time.time() - start:.1f}s')
+    summarize(configs, done)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+""" the torch metrics of metrics.py against sklearn """
+import math
+
+import pytest
+import torch
+
+from metrics import accuracy, eval_acc, eval_rocauc, f1_score, rocauc
+
+sklearn_metrics = pytest.importorskip('sklearn.metrics')
+
+E, n, c, t = 4, 500, 7, 3
+
+
+@pytest.fixture
+def classes():
+    torch.manual_seed(0)
+    y = torch.randint(0, c, (E, n, 1))
+    logits = torch.randn(E, n, c)
+    logits[..., 0] += 1.
+    return y, logits
+
+
+def test_accuracy(classes):
+    y, logits = classes
+    batched = accuracy(y, logits)
+    for e in range(E):
+        ref = (logits[e].argmax(-1) == y[e, :, 0]).to(torch.float).mean().item()
+        assert batched[e].item() == pytest.approx(ref, abs=1e-6)
+        assert eval_acc(y[e], logits[e]) == pytest.approx(ref, abs=1e-6)
+
+
+@pytest.mark.parametrize('average', ['weighted', 'macro'])
+def test_f1(classes, average):
+    y, logits = classes
+    logits[..., c - 1] = -1e9  # a class that is never predicted
+    batched = f1_score(y, logits, average)
+    for e in range(E):
+        ref = sklearn_metrics.f1_score(y[e, :, 0].numpy(), logits[e].argmax(-1).numpy(), average=average)
+        assert batched[e].item() == pytest.approx(ref, abs=1e-5)
+
+
+def rocauc_ref(y, score):
+    """ ogb's ROC-AUC: mean over the columns with both classes among the labeled rows """
+    aucs = []
+    for i in range(y.shape[1]):
+        labeled = ~torch.isnan(y[:, i])
+        column = y[labeled, i]
+        if (column == 1).any() and (column == 0).any():
+            aucs.append(sklearn_metrics.roc_auc_score(column.numpy(), score[labeled, i].numpy()))
+    return sum(aucs) / len(aucs) if aucs else float('nan')
+
+
+def test_rocauc_ties():
+    torch.manual_seed(0)
+    y = torch.randint(0, 2, (E, n, t)).to(torch.float)
+    scores = torch.randint(0, 20, (E, n, t)).to(torch.float)
+    batched = rocauc(y, scores)
+    for e in range(E):
+        assert batched[e].item() == pytest.approx(rocauc_ref(y[e], scores[e]), abs=1e-6)
+
+
+def test_rocauc_single_class_column():
+    torch.manual_seed(0)
+    y = torch.randint(0, 2, (E, n, t)).to(torch.float)
+    y[:, :, 1] = 1.  # only positives, skipped
+    y[0, :, 2] = 0.  # only negatives in one environment
+    scores = torch.randn(E, n, t)
+    batched = rocauc(y, scores)
+    for e in range(E):
+        assert batched[e].item() == pytest.approx(rocauc_ref(y[e], scores[e]), abs=1e-6)
+
+
+def test_rocauc_nan_labels():
+    torch.manual_seed(0)
+    y = torch.randint(0, 2, (E, n, t)).to(torch.float)
+    y[torch.rand(E, n, t) < 0.3] = float('nan')
+    y[1, :, 0] = float('nan')  # an unlabeled column
+    scores = torch.randint(0, 20, (E, n, t)).to(torch.float)
+    batched = rocauc(y, scores)
+    for e in range(E):
+        assert batched[e].item() == pytest.approx(rocauc_ref(y[e], scores[e]), abs=1e-6)
+
+    y[2] = float('nan')
+    assert math.isnan(rocauc(y, scores)[2].item())
+
+
+def test_eval_rocauc_binary():
+    torch.manual_seed(0)
+    y = torch.randint(0, 2, (n, 1))
+    logits = torch.randn(n, 2)
+    ref = sklearn_metrics.roc_auc_score(y[:, 0].numpy(), torch.softmax(logits, -1)[:, 1].numpy())
+    assert eval_rocauc(y, logits) == pytest.approx(ref, abs=1e-6)
+
+    with pytest.raises(RuntimeError):
+        eval_rocauc(torch.ones(n, 1, dtype=torch.long), logits)
@@ -0,0 +1,61 @@
+""" config hashes and the store of results.py """
+import argparse
+import sqlite3
+
+import pytest
+
+from parse import parser_add_main_args
+from results import ResultStore, config_hash, config_of, epoch_rows
+
+
+def parse(*argv):
+    parser = argparse.ArgumentParser()
+    parser_add_main_args(parser)
+    return parser.parse_args(['--method', 'iene'] + list(argv))
+
+
+def test_run_args_are_not_hashed():
+    key = config_hash(parse())
+    assert config_hash(parse('--cpu', '--runs', '2', '--display_step', '10', '--profile', 'prof')) == key
+    assert config_hash(parse('--checkpoint', 'ckpt.pt', '--resume', '--results_db', 'results.db')) == key
+    assert config_hash(parse('--memory_budget', '8', '--auto_scale', '--dry_run')) == key
+    assert config_hash(parse('--mode', 'ann')) != key
+
+
+def test_seeding_is_hashed():
+    # sequential runs draw from one stream seeded once, the others reseed every run
+    sequential = config_hash(parse())
+    parallel = config_hash(parse('--parallel_runs', '2'))
+    cached = config_hash(parse('--pretrain_cache', 'cache'))
+    assert parallel != sequential
+    assert cached == parallel
+    assert config_hash(parse('--pretrain_cache', 'cache', '--method', 'erm')) == config_hash(parse('--method', 'erm'))
+
+
+def test_sweep_seeding():
+    from sweep import config_args
+    args = config_args({'lr': 0.01}, parse())
+    assert config_of(args)['seeding'] == 'per_run'
+    assert config_hash(args) == config_hash(parse('--parallel_runs', '2'))
+
+
+def test_store_resume_and_collision(tmp_path):
+    path = str(tmp_path / 'results.db')
+    store = ResultStore(path)
+    for run in range(2):
+        for epoch in range(10):
+            store.write(epoch_rows('key', run, epoch, [0.5, 0.4, 0.3], 'acc'))
+    # resumed from the checkpoint of run 0 after epoch 6: epochs 6.. and run 1 are trained again
+    store.truncate('key', 0, 6)
+    for epoch in range(6, 10):
+        store.write(epoch_rows('key', 0, epoch, [0.5, 0.4, 0.3], 'acc'))
+    store.close()
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('SELECT run, COUNT(*) FROM results GROUP BY run').fetchall() == [(0, 30)]
+
+    store = ResultStore(path)
+    store.write(epoch_rows('key', 0, 3, [0.5, 0.4, 0.3], 'acc'))
+    with pytest.raises(ValueError):
+        store.close()
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM results').fetchone()[0] == 30
@@ -0,0 +1,581 @@
+import hashlib
+import json
+import os
+import random
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from checkpoint import AsyncCheckpointer, load_checkpoint, snapshot, save_atomic
+from dataset import load_nc_dataset, gen_dir
+from data_utils import evaluate_whole_graph
+from metrics import eval_acc, eval_rocauc, eval_f1, eval_macro_f1
+from parse import parse_method_base, parse_method_ours
+from profiling import section
+import profiling
+from reorder import reorder_datasets
+from results import config_hash, epoch_rows
+
+
+# NOTE: for consistent data splits, see data_utils.rand_train_test_idx
+def fix_seed(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    torch.cuda.manual_seed(seed)
+    torch.cuda.manual_seed_all(seed)  # if you are using multi-GPU.
+    torch.backends.cudnn.deterministic = True
+
+
+def get_rng_state():
+    state = {'random': random.getstate(),
+             'numpy': np.random.get_state(),
+             'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['random'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def get_device(args):
+    if args.cpu or not torch.cuda.is_available():
+        return torch.device("cpu")
+    return torch.device("cuda:" + str(args.device))
+
+
+def get_dataset(args, dataset, sub_dataset=None, gen_model=None):
+    ### Load and preprocess data ###
+    if dataset == 'cora':
+        dataset = load_nc_dataset(args.data_dir, 'cora', sub_dataset, gen_model)
+    elif dataset == 'amazon-photo':
+        dataset = load_nc_dataset(args.data_dir, 'amazon-photo', sub_dataset, gen_model)
+    else:
+        raise ValueError('Invalid dataname')
+
+    if len(dataset.label.shape) == 1:
+        dataset.label = dataset.label.unsqueeze(1)
+
+    dataset.n = dataset.graph['num_nodes']
+    dataset.c = max(dataset.label.max().item() + 1, dataset.label.shape[1])
+    dataset.d = dataset.graph['node_feat'].shape[1]  # the number of features
+    return dataset
+
+
+def load_datasets(args):
+    """ returns dataset_tr, dataset_val, datasets_te of args.dataset and args.gnn_gen """
+    if args.dataset in ('cora', 'amazon-photo'):
+        tr_sub, val_sub, te_subs = [0], [1], list(range(2, 10))
+    else:
+        raise ValueError('Invalid dataname')
+    gen_model = args.gnn_gen
+    dataset_tr = get_dataset(args, args.dataset, sub_dataset=tr_sub[0], gen_model=gen_model)
+    dataset_val = get_dataset(args, args.dataset, sub_dataset=val_sub[0], gen_model=gen_model)
+    datasets_te = [get_dataset(args, args.dataset, sub_dataset=te_sub, gen_model=gen_model) for te_sub in te_subs]
+    if args.reorder != 'none':
+        path = os.path.join(gen_dir(args.data_dir, args.dataset), f'order-{args.reorder}.pt')
+        reorder_datasets((dataset_tr, dataset_val, datasets_te), args.reorder, path)
+    return dataset_tr, dataset_val, datasets_te
+
+
+def share_datasets(datasets):
+    """ moves the tensors of the environments to shared memory for worker processes """
+    dataset_tr, dataset_val, datasets_te = datasets
+    for dataset in [dataset_tr, dataset_val] + list(datasets_te):
+        for key, value in dataset.graph.items():
+            if torch.is_tensor(value):
+                value.share_memory_()
+        dataset.label.share_memory_()
+
+
+def get_criterion(args):
+    if args.rocauc:
+        return nn.BCEWithLogitsLoss()
+    return nn.NLLLoss()
+
+
+def get_eval_func(args):
+    if args.rocauc or args.metric == 'rocauc':
+        return eval_rocauc
+    elif args.metric == 'f1':
+        return eval_f1
+    elif args.metric == 'macro_f1':
+        return eval_macro_f1
+    return eval_acc
+
+
+def build_model(args, dataset, device):
+    if args.method == 'erm':
+        return parse_method_base(args, dataset, dataset.n, dataset.c, dataset.d, device)
+    return parse_method_ours(args, dataset, dataset.n, dataset.c, dataset.d, device)
+
+
+# args that the IENE pretraining phase (steps 1-4) depends on
+PRETRAIN_ARGS = ['data_dir', 'dataset', 'gnn_gen', 'method', 'gnn', 'hidden_channels', 'num_layers', 'dropout',
+                 'no_bn', 'gat_heads', 'gpr_alpha', 'gcnii_alpha', 'gcnii_lamda', 'e', 'lr', 'lr_a', 'weight_decay',
+                 'penalty_weight', 'kernel', 'idp_type', 'idp', 'pud_ro_step', 'pre_epochs', 'pretrain_train_mode',
+                 'eval_every', 'rocauc', 'metric', 'seed', 'precision', 'gat_chunk']
+
+
+class Trainer(object):
+    """ trains one run of args.method, building the model and its optimizers """
+    def __init__(self, args, datasets, device, criterion, eval_func, run=0, verbose=True):
+        self.args = args
+        self.dataset_tr, self.dataset_val, self.datasets_te = datasets
+        self.device = device
+        self.criterion = criterion
+        self.eval_func = eval_func
+        self.run = run
+        self.verbose = verbose
+        self.cache_path = None
+        if args.method == 'iene' and args.pretrain_cache:
+            # cached runs are seeded per run, so that the key determines the pretrained state
+            fix_seed(args.seed + run)
+            self.cache_path = os.path.join(args.pretrain_cache, self.pretrain_key() + '.pt')
+
+        model = build_model(args, self.dataset_tr, device)
+        if args.method == 'erm':
+            self.optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+        elif args.method == 'iene':
+            model.init_env_adj(self.dataset_tr)
+            self.optimizer_ir_learner = torch.optim.SGD(list(model.ir_Learner.parameters())
+                                                        + list(model.decoder.parameters()), lr=args.lr_a)
+            self.optimizer_gnn_cls = torch.optim.AdamW(list(model.gnn.parameters())
+                                                       + list(model.cls.parameters())
+                                                       + list(model.e_cls.parameters()), lr=args.lr,
+                                                       weight_decay=args.weight_decay)
+            dif_cls_list = list(model.dif_cls[0].parameters())
+            for i in range(1, args.e):
+                dif_cls_list = dif_cls_list + list(model.dif_cls[i].parameters())
+            self.optimizer_cls = torch.optim.AdamW(dif_cls_list, lr=args.lr, weight_decay=args.weight_decay)
+            self.optimizer_env_cls = torch.optim.AdamW(model.e_cls.parameters(), lr=args.lr_a)
+        self.model = model
+        profiling.watch(model)
+        self.x = self.dataset_tr.graph['node_feat'].to(device)
+
+        self.results = []
+        self.phase = 'pretrain' if args.method == 'iene' and args.pre_epochs > 0 else 'train'
+        self.epoch = 0  # epoch within the phase
+        self.done_epochs = 0
+
+        # best valid so far, Logger.print_statistics reports the same (first) argmax
+        self.track_best = args.patience > 0 or bool(args.best_dir)
+        self.best_valid = float('-inf')
+        self.best_index = -1  # index into self.results
+        self.best_state = None
+        self.bad_evals = 0
+        self.stopped = False
+        self.train_time = 0.
+        self.timings = {'pretrain': 0., 'train': 0., 'evaluate': 0.}  # seconds per part
+
+        # rows for the results store, drained by the caller
+        self.store_key = config_hash(args) if args.results_db else None
+        self.metric = 'rocauc' if args.rocauc else args.metric
+        self.rows = []
+
+    def optimizers(self):
+        if self.args.method == 'erm':
+            return {'optimizer': self.optimizer}
+        return {'optimizer_ir_learner': self.optimizer_ir_learner, 'optimizer_gnn_cls': self.optimizer_gnn_cls,
+                'optimizer_cls': self.optimizer_cls, 'optimizer_env_cls': self.optimizer_env_cls}
+
+    def model_state(self):
+        """ model weights including dif_cls, without the dense adj_continuous placeholder """
+        state = {'model': {k: v for k, v in self.model.state_dict().items() if k != 'adj_continuous'}}
+        if self.args.method == 'iene':
+            state['dif_cls'] = [cls.state_dict() for cls in self.model.dif_cls]
+        return state
+
+    def load_model_state(self, state):
+        missing, unexpected = self.model.load_state_dict(state['model'], strict=False)
+        assert set(missing) <= {'adj_continuous'} and len(unexpected) == 0, (missing, unexpected)
+        for cls, cls_state in zip(self.model.dif_cls if 'dif_cls' in state else [], state.get('dif_cls', [])):
+            cls.load_state_dict(cls_state)
+
+    def state(self):
+        """ everything needed to continue the run bit-exactly """
+        state = self.model_state()
+        model = self.model
+        if self.args.method == 'iene':
+            # adj_continuous is not saved, step 6 resets it to the identity before every use
+            state['env_adj'] = list(model.env_adj)
+            state['inv_feature'] = model.inv_feature
+            if hasattr(model, 'ann_index'):
+                state['ann_index'] = dict(vars(model.ann_index))
+        for name, optimizer in self.optimizers().items():
+            state[name] = optimizer.state_dict()
+        state['rng'] = get_rng_state()
+        state['results'] = list(self.results)
+        state['counters'] = {'phase': self.phase, 'epoch': self.epoch, 'done_epochs': self.done_epochs,
+                             'best_valid': self.best_valid, 'best_index': self.best_index,
+                             'bad_evals': self.bad_evals, 'stopped': self.stopped, 'train_time': self.train_time}
+        state['best_state'] = self.best_state
+        return state
+
+    def load_state(self, state):
+        self.load_model_state(state)
+        model = self.model
+        if self.args.method == 'iene':
+            model.env_adj = [adj.to(self.device) for adj in state['env_adj']]
+            model.inv_feature = state['inv_feature'].to(self.device) if state['inv_feature'] is not None else None
+            if 'ann_index' in state:
+                for key, value in state['ann_index'].items():
+                    setattr(model.ann_index, key, value.to(self.device) if torch.is_tensor(value) else value)
+        for name, optimizer in self.optimizers().items():
+            optimizer.load_state_dict(state[name])
+        set_rng_state(state['rng'])
+        self.results = list(state['results'])
+        for key, value in state['counters'].items():
+            setattr(self, key, value)
+        self.best_state = state['best_state']
+
+    def pretrain_key(self):
+        config = {key: getattr(self.args, key, None) for key in PRETRAIN_ARGS}
+        config['run'] = self.run
+        config['num_nodes'] = self.dataset_tr.n
+        config['num_edges'] = self.dataset_tr.graph['edge_index'].shape[1]
+        if getattr(self.args, 'reorder', 'none') != 'none':  # keeps the keys of earlier caches
+            config['reorder'] = self.args.reorder
+        return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:32]
+
+    def load_pretrained(self, logger=None):
+        """ restores the pretrained state from the cache, returns whether it hit """
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return False
+        state = torch.load(self.cache_path, map_location=self.device)
+        self.load_model_state(state)
+        for name, optimizer in self.optimizers().items():
+            optimizer.load_state_dict(state[name])
+        set_rng_state(state['rng'])
+        epochs = [e for e in range(self.args.pre_epochs)
+                  if e % self.args.eval_every == 0 or e == self.args.pre_epochs - 1]
+        for epoch, accs in zip(epochs, state['results']):
+            self.record(accs, logger, epoch, snapshot_best=False)
+        if self.track_best:
+            # caches written without best tracking only have the final pretrained weights
+            self.best_state = state.get('best_state') or snapshot(self.model_state())
+        self.phase, self.epoch, self.bad_evals = 'train', 0, 0
+        self.done_epochs = self.args.pre_epochs
+        if self.verbose:
+            print(f'Loaded pretrained state from {self.cache_path}')
+        return True
+
+    def save_pretrained(self):
+        state = self.model_state()
+        for name, optimizer in self.optimizers().items():
+            state[name] = optimizer.state_dict()
+        state['rng'] = get_rng_state()
+        state['results'] = list(self.results)
+        state['best_state'] = self.best_state
+        save_atomic(state, self.cache_path)
+
+    def pretrain_epoch(self, epoch):
+        """ steps 1-4 of IENE, returns the mean loss of step 2 """
+        model, args, dataset_tr, criterion = self.model, self.args, self.dataset_tr, self.criterion
+        # the original loop only called model.train() before the first epoch and
+        # evaluated every epoch, so the later pretraining epochs ran in eval mode
+        model.train(epoch == 0 or args.pretrain_train_mode)
+        # minimize dif_cls
+        with section('step1'), self.autocast():
+            Mean = model(dataset_tr, criterion, step=1)
+        dif_cls_loss = Mean
+        with section('opt_cls'):
+            self.optimizer_cls.zero_grad()
+            dif_cls_loss.backward()
+            self.optimizer_cls.step()
+
+        # minimize cls and gnn_inv with dif_cls
+        with section('step2'), self.autocast():
+            Mean = model(dataset_tr, criterion, step=2)
+        cls_loss = Mean
+        with section('opt_gnn_cls'):
+            self.optimizer_gnn_cls.zero_grad()
+            cls_loss.backward()
+            self.optimizer_gnn_cls.step()
+
+        # learn h_s by h_v
+        with section('step3'), self.autocast():
+            ind_loss, rebuiled_x = model(dataset_tr, criterion, step=3)
+        #rebuild_loss = F.kl_div(torch.log(rebuiled_x), x, reduction='batchmean')
+        rebuild_loss = F.mse_loss(rebuiled_x.float(), self.x)
+        env_feature_loss = rebuild_loss + ind_loss * args.idp
+        with section('opt_ir_learner'):
+            self.optimizer_ir_learner.zero_grad()
+            env_feature_loss.backward()
+            self.optimizer_ir_learner.step()
+
+        #  update partition to maximize penalty
+        if epoch % args.pud_ro_step == 0:
+            with section('step4'), self.autocast():
+                Mean_penalty = model(dataset_tr, criterion, step=4)
+            Mean_penalty = -Mean_penalty
+            with section('opt_env_cls'):
+                self.optimizer_env_cls.zero_grad()
+                Mean_penalty.backward()
+                self.optimizer_env_cls.step()
+        return Mean
+
+    def train_epoch(self, epoch):
+        """ one epoch of the main phase, returns the loss (erm) or mean loss (iene) """
+        model, args, dataset_tr, criterion = self.model, self.args, self.dataset_tr, self.criterion
+        model.train()
+        if args.method == 'erm':
+            self.optimizer.zero_grad()
+            with section('forward'), self.autocast():
+                loss = model(dataset_tr, criterion)
+            with section('opt'):
+                loss.backward()
+                self.optimizer.step()
+            return loss
+        # minimize dif_cls w
+        with section('step1'), self.autocast():
+            Mean = model(dataset_tr, criterion, step=1)
+        dif_cls_loss = Mean
+        with section('opt_cls'):
+            self.optimizer_cls.zero_grad()
+            dif_cls_loss.backward()
+            self.optimizer_cls.step()
+        # minimize cls w with dif_cls
+        with section('step5'), self.autocast():
+            Mean = model(dataset_tr, criterion, step=5)
+        cls_loss = Mean
+        with section('opt_gnn_cls'):
+            self.optimizer_gnn_cls.zero_grad()
+            cls_loss.backward()
+            self.optimizer_gnn_cls.step()
+        # x/a = maximize penalty
+        if epoch % args.pud_a_step == 0:
+            with section('step6'), self.autocast():
+                model(dataset_tr, criterion, step=6)
+        return Mean
+
+    def autocast(self):
+        """ bf16 autocast of a forward pass with --precision bf16, the weights,
+        gradients and losses stay fp32 """
+        return torch.autocast(self.device.type, dtype=torch.bfloat16, enabled=self.args.precision == 'bf16')
+
+    def evaluate(self):
+        with self.autocast():
+            accs, _ = evaluate_whole_graph(self.args, self.model, self.dataset_tr, self.dataset_val,
+                                           self.datasets_te, self.eval_func)
+        return accs
+
+    def display(self, epoch, loss, accs):
+        if not self.verbose or epoch % self.args.display_step != 0:
+            return
+        name = 'Loss' if self.args.method == 'erm' else 'Mean Loss'
+        print(f'Epoch: {epoch:02d}, '
+              f'{name}: {loss:.4f}, '
+              f'Train: {100 * accs[0]:.2f}%, '
+              f'Valid: {100 * accs[1]:.2f}%, ')
+        test_info = ''
+        for test_acc in accs[2:]:
+            test_info += f'Test: {100 * test_acc:.2f}% '
+        print(test_info)
+
+    def record(self, accs, logger=None, epoch=None, loss=None, train_time=0., eval_time=0., snapshot_best=True):
+        """ stores the accs of an evaluated epoch and tracks the best valid one """
+        self.results.append(accs)
+        if logger is not None:
+            logger.add_result(self.run, accs)
+        if self.store_key is not None:
+            self.rows += epoch_rows(self.store_key, self.run, epoch, accs, self.metric, loss, train_time, eval_time)
+        if float(accs[1]) > self.best_valid:
+            self.best_valid, self.best_index = float(accs[1]), len(self.results) - 1
+            self.bad_evals = 0
+            if self.track_best and snapshot_best:
+                self.best_state = snapshot(self.model_state())
+                if self.args.best_dir:
+                    save_atomic(self.best_state, os.path.join(self.args.best_dir, f'run{self.run}.pt'))
+        else:
+            self.bad_evals += 1
+
+    def restore_best(self):
+        """ loads the weights of the best valid epoch back into the model """
+        if self.best_state is not None:
+            self.load_model_state(self.best_state)
+
+    def phase_epochs(self):
+        if self.phase == 'pretrain':
+            return self.args.pre_epochs, self.pretrain_epoch
+        return self.args.epochs, self.train_epoch
+
+    def total_epochs(self):
+        pre_epochs = self.args.pre_epochs if self.args.method == 'iene' else 0
+        return pre_epochs + self.args.epochs
+
+    def step(self, logger=None):
+        """ trains one epoch of the current phase and evaluates it if due,
+        returns the accs of the epoch or None
+        """
+        if self.phase == 'pretrain' and self.epoch == 0 and self.load_pretrained(logger):
+            return None
+        epochs, epoch_fn = self.phase_epochs()
+        if self.phase == 'train' and self.epoch == 0 and self.verbose:
+            print("****************preparing end***************")
+        profiling.next_epoch(self.run, self.done_epochs)
+        start = time.time()
+        with section(self.phase):
+            loss = epoch_fn(self.epoch)
+        train_time = time.time() - start
+        self.timings[self.phase] += train_time
+        accs = None
+        if self.epoch % self.args.eval_every == 0 or self.epoch == epochs - 1:
+            start = time.time()
+            with section('evaluate'):
+                accs = self.evaluate()
+            eval_time = time.time() - start
+            self.timings['evaluate'] += eval_time
+            self.record(accs, logger, self.done_epochs, loss, train_time, eval_time)
+            self.display(self.epoch, loss, accs)
+        self.epoch += 1
+        self.done_epochs += 1
+        if self.phase == 'train' and 0 < self.args.patience <= self.bad_evals:
+            self.stop(f'no valid improvement in {self.bad_evals} evaluations')
+        if self.phase == 'pretrain' and self.epoch == epochs:
+            if self.cache_path is not None:
+                self.save_pretrained()
+            # the main phase gets its own patience
+            self.phase, self.epoch, self.bad_evals = 'train', 0, 0
+        return accs
+
+    def stop(self, reason):
+        self.stopped = True
+        if self.verbose:
+            best = self.results[self.best_index]
+            print(f'Early stopping after {self.done_epochs} epochs ({reason}), '
+                  f'best valid {100 * float(best[1]):.2f}%')
+
+    def fit(self, logger=None, budget=None, on_epoch=None):
+        """ runs the pretraining (iene) and main phases up to budget epochs in
+        total (default: all of them), returns the evaluated results so far.
+        on_epoch(trainer, accs) is called after every epoch. the run stops early
+        after --patience evaluations of the main phase without a better valid
+        score, or once it has trained for --time_budget seconds
+        """
+        budget = self.total_epochs() if budget is None else min(budget, self.total_epochs())
+        while self.done_epochs < budget and not self.stopped:
+            start = time.time()
+            accs = self.step(logger)
+            self.train_time += time.time() - start
+            if 0 < self.args.time_budget <= self.train_time and not self.stopped:
+                if accs is None:
+                    # the last trained epoch has to be evaluated
+                    accs = self.evaluate()
+                    self.record(accs, logger, self.done_epochs - 1)
+                self.stop(f'time budget of {self.args.time_budget}s')
+            if on_epoch is not None:
+                on_epoch(self, accs)
+        return self.results
+
+
+def train_runs(args, datasets, device, logger, store=None):
+    """ trains args.runs runs of args on datasets and adds their results to
+    logger (and store). sequential runs resume from and write --checkpoint and
+    are profiled with --profile. returns the model of the last run with its
+    best weights
+    """
+    criterion, eval_func = get_criterion(args), get_eval_func(args)
+    if args.parallel_runs > 1:
+        if device.type != 'cpu':
+            raise ValueError('--parallel_runs trains on forked CPU workers, use --cpu')
+        if args.checkpoint or args.profile:
+            raise ValueError('--checkpoint and --profile are only supported for sequential runs')
+        state = train_parallel(args, datasets, logger, args.parallel_runs, store)
+        model = build_model(args, datasets[0], device)
+        model.load_state_dict(state)
+        return model
+
+    start_run, resume_state = 0, None
+    if args.resume and os.path.exists(args.checkpoint):
+        ckpt = load_checkpoint(args.checkpoint, device)
+        logger.load_state(ckpt['logger'])
+        start_run, resume_state = ckpt['run'], ckpt['trainer']
+        if resume_state is None:
+            set_rng_state(ckpt['rng'])
+        if store is not None:
+            epoch = resume_state['counters']['done_epochs'] if resume_state is not None else 0
+            store.truncate(config_hash(args), start_run, epoch)
+        print(f'Resuming run {start_run + 1} from {args.checkpoint}')
+    checkpointer = AsyncCheckpointer(args.checkpoint) if args.checkpoint else None
+    if args.profile:
+        profiling.start(args.profile, device, args.profile_trace)
+
+    def on_epoch(trainer, accs):
+        if store is not None:
+            store.write(trainer.rows)
+            trainer.rows = []
+        if checkpointer and trainer.done_epochs % args.checkpoint_every == 0:
+            checkpointer.save({'run': trainer.run, 'trainer': trainer.state(), 'logger': logger.state()})
+
+    model = None
+    for run in range(start_run, args.runs):
+        trainer = Trainer(args, datasets, device, criterion, eval_func, run=run)
+        if resume_state is not None:
+            trainer.load_state(resume_state)
+            resume_state = None
+        trainer.fit(logger, on_epoch=on_epoch)
+        trainer.restore_best()
+        model = trainer.model
+
+        logger.print_statistics(run)
+        if checkpointer:
+            checkpointer.save({'run': run + 1, 'trainer': None, 'logger': logger.state(), 'rng': get_rng_state()})
+    if checkpointer:
+        checkpointer.close()
+    profiling.finish()
+    return model
+
+
+_shared = {}
+
+
+def _init_worker(args, datasets, num_threads):
+    torch.set_num_threads(num_threads)
+    _shared['args'] = args
+    _shared['datasets'] = datasets
+
+
+def _train_worker(run):
+    args, datasets = _shared['args'], _shared['datasets']
+    fix_seed(args.seed + run)
+    start = time.time()
+    trainer = Trainer(args, datasets, torch.device('cpu'), get_criterion(args), get_eval_func(args),
+                      run=run, verbose=False)
+    results = trainer.fit()
+    trainer.restore_best()
+    state = trainer.model.state_dict() if run == args.runs - 1 else None
+    return run, results, time.time() - start, state, trainer.rows
+
+
+def train_parallel(args, datasets, logger, num_workers, store=None):
+    """ trains args.runs independent runs on a pool of forked CPU workers.
+    the environments are moved to shared memory once and every run seeds its
+    own RNG streams with args.seed + run, so results do not depend on scheduling.
+    returns the state dict of the model of the last run
+    """
+    import torch.multiprocessing as mp
+
+    share_datasets(datasets)
+    num_threads = max(1, torch.get_num_threads() // num_workers)
+    ctx = mp.get_context('fork')
+    with ctx.Pool(num_workers, initializer=_init_worker, initargs=(args, datasets, num_threads)) as pool:
+        for run, results, elapsed, state, rows in pool.imap_unordered(_train_worker, range(args.runs)):
+            for accs in results:
+                logger.add_result(run, accs)
+            if store is not None:
+                store.write(rows)
+            if state is not None:
+                last_state = state
+            print(f'Run {run + 1:02d} finished in {elapsed:.1f}s')
+            logger.print_statistics(run)
+    return last_state
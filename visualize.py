@@ -1,15 +1,18 @@
+import sys
+
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+import torch
 
-df = pd.read_csv('train_feature_importance.csv')
-df2 = pd.read_csv('test_feature_importance.csv')
-#df = pd.read_csv('train_feature_importance_iene.csv')
-#df2 = pd.read_csv('test_feature_importance_iene.csv')
+# python visualize.py results/cora-erm-gcn-importance.pt [env], the train
+# environment against env (default the last test environment)
+saved = torch.load(sys.argv[1] if len(sys.argv) > 1 else 'results/cora-erm-gcn-importance.pt')
+env = int(sys.argv[2]) if len(sys.argv) > 2 else -1
 
-features = df['Feature']
-importances = df['Importance']
-importances2 = df2['Importance']
+features = pd.Series([f'Feature {i+1}' for i in range(saved['importance'].shape[1])])
+importances = pd.Series(saved['importance'][0].numpy())
+importances2 = pd.Series(saved['importance'][env].numpy())
 #features = df['Feature'][-100:]
 #importances = df['Importance'][-100:]
 